@@ -0,0 +1,289 @@
+import asyncio
+import json
+import os
+import time
+import weakref
+
+import aiohttp
+
+import http_client
+import metrics
+import ssml
+from rate_limit import get_limiter, parse_retry_after
+from get_token import IAM_URL, build_iam_request
+from model import (
+    CHUNK_TOKENS,
+    RECOVERY_ROUNDS,
+    build_request_body,
+    decode_generation,
+    finish_narration,
+    narration_cache_key,
+    plan_narration,
+    recall_narration,
+    recovery_failed,
+    recovery_requests,
+    request_headers,
+    stitch_narrations,
+    url as WATSONX_URL,
+)
+from token_budget import record_generation
+from token_manager import get_token_manager, invalidate_bearer
+from tts import (
+    AUDIO_FORMAT,
+    FALLBACK_VOICE,
+    URL as TTS_URL,
+    audio_cache,
+    audio_cache_key,
+    resolve_voice,
+)
+
+# In-flight requests per service, shared by every caller on one event loop
+WATSONX_CONCURRENCY = int(os.getenv("ECHOVERSE_ASYNC_WATSONX_CONCURRENCY", 32))
+TTS_CONCURRENCY = int(os.getenv("ECHOVERSE_ASYNC_TTS_CONCURRENCY", 32))
+IAM_CONCURRENCY = 4
+
+_loop_state = weakref.WeakKeyDictionary()
+
+
+def _state():
+    """Session and semaphores belonging to the running event loop."""
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+    if state is None:
+        state = {
+            "session": aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=http_client.POOL_SIZE),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=http_client.CONNECT_TIMEOUT,
+                    sock_read=http_client.READ_TIMEOUT),
+            ),
+            "iam": asyncio.Semaphore(IAM_CONCURRENCY),
+            "watsonx": asyncio.Semaphore(WATSONX_CONCURRENCY),
+            "tts": asyncio.Semaphore(TTS_CONCURRENCY),
+        }
+        _loop_state[loop] = state
+    return state
+
+
+async def close():
+    """Close the HTTP session of the running event loop."""
+    state = _loop_state.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        await state["session"].close()
+
+
+async def _request(service, method, request_url, **kwargs):
+    """
+    Send a request on the loop's shared session, holding the service's
+    semaphore, with the same retry policy as http_client.request. Requests
+    also share the service's rate limiter with the synchronous clients.
+
+    Returns:
+        (status, body bytes) of the final response.
+    """
+    state = _state()
+    limiter = get_limiter(service)
+    for attempt in range(http_client.MAX_RETRIES + 1):
+        retry_after = None
+        try:
+            async with state[service]:
+                while delay := limiter.try_acquire():
+                    await asyncio.sleep(delay)
+                status = None
+                try:
+                    async with state["session"].request(method, request_url, **kwargs) as response:
+                        status = response.status
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        if (status not in http_client.RETRY_STATUSES
+                                or attempt == http_client.MAX_RETRIES):
+                            return status, await response.read()
+                finally:
+                    limiter.release(status, retry_after)
+            print(f"🔄 {method} {request_url} returned {status}, retrying")
+            metrics.count("retries", service=service, reason=status)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt == http_client.MAX_RETRIES:
+                raise
+            print(f"🔄 {method} {request_url} failed ({e}), retrying")
+            metrics.count("retries", service=service, reason=type(e).__name__)
+        await asyncio.sleep(http_client.retry_delay(attempt, retry_after))
+
+
+async def _resolve_token(access_token):
+    """Accept a bearer string, a callable or a coroutine function."""
+    if asyncio.iscoroutinefunction(access_token):
+        return await access_token()
+    if callable(access_token):
+        # Token managers may block on a refresh; keep the loop responsive
+        return await asyncio.to_thread(access_token)
+    return access_token
+
+
+async def _post_authorized(service, request_url, access_token, accept="application/json",
+                           **kwargs):
+    """
+    POST with a bearer from access_token, as model.post_generation: after
+    a 401 a token manager's token is dropped and the request sent once
+    more with a fresh one.
+
+    Returns:
+        (status, body bytes) of the final response.
+    """
+    for attempt in range(2):
+        headers = request_headers(await _resolve_token(access_token), accept=accept)
+        status, body = await _request(service, "POST", request_url, headers=headers, **kwargs)
+        if status != 401 or attempt or not invalidate_bearer(access_token):
+            return status, body
+        print(f"🔑 The {service} service rejected the IAM token, retrying with a new one")
+        metrics.count("token_rejections", service=service)
+
+
+async def async_request_iam_token(api_key):
+    """Async counterpart of get_token.request_iam_token."""
+    headers, data = build_iam_request(api_key)
+    status, body = await _request("iam", "POST", IAM_URL, headers=headers, data=data)
+    if status >= 400:
+        raise Exception(f"IAM token request failed: {status} - {body.decode('utf-8', 'replace')}")
+    payload = json.loads(body)
+    if not payload.get("access_token"):
+        raise KeyError(f"access_token missing in IAM response: {payload}")
+    return payload
+
+
+async def async_get_ibm_iam_bearer(api_key):
+    """Async counterpart of get_token.get_ibm_iam_bearer."""
+    payload = await async_request_iam_token(api_key)
+    return f"Bearer {payload['access_token']}"
+
+
+async def _narrate_chunk(text, tone, access_token, context="", use_cache=True,
+                         checkpoint=None, recovery_rounds=RECOVERY_ROUNDS):
+    """
+    Async counterpart of model._narrate_chunk, built from the same steps.
+    Cache, checkpoint and calibration I/O run in worker threads so the
+    event loop never blocks on disk.
+    """
+    key = narration_cache_key(text, tone, context)
+    cached = await asyncio.to_thread(recall_narration, key, use_cache, checkpoint)
+    if cached is not None:
+        return cached
+
+    request_body = build_request_body(text, tone, context)
+    started = time.perf_counter()
+    with metrics.span("watsonx.generate", input_chars=len(text) + len(context),
+                      max_new_tokens=request_body["parameters"]["max_new_tokens"]) as span:
+        status, body = await _post_authorized(
+            "watsonx", WATSONX_URL, access_token, json=request_body)
+        if status >= 400:
+            raise Exception(f"Error from WatsonX: {body.decode('utf-8', 'replace')}")
+        payload = json.loads(body)
+        generation = payload["results"][0]
+        span.set(response_bytes=len(body),
+                 input_tokens=generation.get("input_token_count", 0),
+                 generated_tokens=generation.get("generated_token_count", 0))
+    await asyncio.to_thread(record_generation, text, request_body["input"], generation,
+                            time.perf_counter() - started)
+
+    result, parser = decode_generation(generation["generated_text"])
+    requests = recovery_requests(text, context, result, parser, recovery_rounds)
+    parts = await asyncio.gather(*(
+        _recover_span(span_text, tone, access_token, span_context, use_cache,
+                      checkpoint, recovery_rounds - 1)
+        for _, span_text, span_context in requests
+    ))
+    return await asyncio.to_thread(finish_narration, key, text, result, parser, requests,
+                                   list(parts), use_cache, checkpoint)
+
+
+async def _recover_span(text, tone, access_token, context, use_cache, checkpoint,
+                        recovery_rounds):
+    try:
+        return await _narrate_chunk(text, tone, access_token, context, use_cache,
+                                    checkpoint, recovery_rounds)
+    except Exception as e:
+        return recovery_failed(e)
+
+
+async def async_genrate_reader_json(text, tone, access_token, use_cache=True,
+                                    chunk_tokens=CHUNK_TOKENS, checkpoint=None):
+    """
+    Async counterpart of model.genrate_reader_json.
+
+    Chunks of one document, and chunks of every other document narrated on
+    the same event loop, share one bounded pool of WatsonX requests.
+    """
+    chunks = plan_narration(text, chunk_tokens)
+    if len(chunks) <= 1:
+        return await _narrate_chunk(text, tone, access_token, use_cache=use_cache,
+                                    checkpoint=checkpoint)
+
+    parts = await asyncio.gather(*(
+        _narrate_chunk(chunk["text"], tone, access_token, chunk["context"], use_cache,
+                       checkpoint)
+        for chunk in chunks
+    ))
+    return stitch_narrations(parts)
+
+
+async def _synthesize(synthesis_text, voice, access_token, accept):
+    with metrics.span("tts.synthesize", voice=voice, chars=len(synthesis_text)) as span:
+        status, body = await _post_authorized(
+            "tts", f"{TTS_URL}/v1/synthesize", access_token, accept=accept,
+            params={"voice": voice},
+            json={"text": synthesis_text},
+        )
+        if status >= 400:
+            raise Exception(f"Error from TTS: {status} - {body.decode('utf-8', 'replace')}")
+        span.set(bytes=len(body))
+    return body
+
+
+async def async_synthesize_segment(synthesis_text, voice_name, api_key,
+                                   fallback_text=None, accept=AUDIO_FORMAT,
+                                   use_cache=True):
+    """
+    Synthesize one rendered batch, sharing the audio cache with tts.
+
+    Args:
+        synthesis_text: SSML or plain text, as produced by tts.render_batches.
+        voice_name: Voice name from tts.ENGLISH_VOICES.
+        api_key: TTS API key.
+        fallback_text: Plain text to read with the basic voice if the
+            requested voice fails.
+        accept: Audio MIME type.
+        use_cache: Reuse and store audio in the audio cache.
+
+    Returns:
+        The audio bytes.
+    """
+    voice = resolve_voice(voice_name)
+    key = audio_cache_key(synthesis_text, voice, accept)
+    if use_cache:
+        cached = await asyncio.to_thread(audio_cache.get, key)
+        if cached is not None:
+            return cached
+
+    access_token = get_token_manager(api_key).get_bearer
+    try:
+        content = await _synthesize(synthesis_text, voice, access_token, accept)
+    except Exception as e:
+        if fallback_text is None:
+            raise
+        print(f"❌ Error with {voice} voice: {e}")
+        print("🔄 Falling back to basic synthesis...")
+        return await _synthesize(fallback_text, FALLBACK_VOICE, access_token, accept)
+
+    if use_cache:
+        await asyncio.to_thread(audio_cache.set, key, content)
+    return content
+
+
+async def async_synthesize_batches(batches, voice_name, api_key, accept=AUDIO_FORMAT):
+    """Synthesize (synthesis_text, objects) batches concurrently, in order."""
+    return await asyncio.gather(*(
+        async_synthesize_segment(
+            synthesis_text, voice_name, api_key,
+            fallback_text=ssml.strip_expression(synthesis_text),
+            accept=accept)
+        for synthesis_text, _ in batches
+    ))
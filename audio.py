@@ -0,0 +1,291 @@
+import os
+import zlib
+
+# name -> (MIME type requested from the service, MIME type for players,
+# file extension)
+FORMATS = {
+    "mp3": ("audio/mp3", "audio/mpeg", ".mp3"),
+    "ogg": ("audio/ogg;codecs=opus", "audio/ogg", ".ogg"),
+    "wav": ("audio/wav", "audio/wav", ".wav"),
+}
+# Sample rates Opus encodes at; lower rates give smaller files
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+# Bytes read or written at a time when streaming audio
+CHUNK_BYTES = 64 * 1024
+
+# Bitrates in kbps for Layer III, indexed by the 4-bit header field
+_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0],
+}
+_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG 1
+    2: [22050, 24000, 16000],  # MPEG 2
+    0: [11025, 12000, 8000],   # MPEG 2.5
+}
+
+
+def _strip_id3(data):
+    """Remove a leading ID3v2 tag and a trailing ID3v1 tag."""
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = 0
+        for byte in data[6:10]:
+            size = (size << 7) | (byte & 0x7F)
+        size += 10
+        if data[5] & 0x10:  # footer present
+            size += 10
+        data = data[size:]
+    if len(data) >= 128 and data[-128:-125] == b"TAG":
+        data = data[:-128]
+    return data
+
+
+def _frame_length(header):
+    """Length in bytes of the MPEG Layer III frame starting with header."""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    if version == 1 or layer != 1:  # reserved version, or not Layer III
+        return None
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x03
+    if rate_index == 3:
+        return None
+    bitrate = _BITRATES[1 if version == 3 else 2][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    if not bitrate:
+        return None
+    padding = (header[2] >> 1) & 0x01
+    coefficient = 144 if version == 3 else 72
+    return coefficient * bitrate // sample_rate + padding
+
+
+def _strip_info_frame(data):
+    """
+    Drop a leading Xing/Info/VBRI frame. It describes the length of a single
+    segment and would make players report the wrong duration once joined.
+    """
+    length = _frame_length(data[:4])
+    if length and any(tag in data[:min(length, 64)] for tag in (b"Xing", b"Info", b"VBRI")):
+        return data[length:]
+    return data
+
+
+def join_mp3(parts):
+    """
+    Concatenate MP3 byte strings into one stream.
+
+    MP3 is a sequence of self-contained frames, so segments can be joined by
+    concatenating their frames once per-file tags and header frames are
+    removed.
+    """
+    return b"".join(_strip_info_frame(_strip_id3(part)) for part in parts if part)
+
+
+def join_mp3_files(paths, output_file):
+    """join_mp3 for files, holding one part in memory at a time."""
+    with open(output_file, "wb") as out:
+        for path in paths:
+            with open(path, "rb") as f:
+                out.write(join_mp3([f.read()]))
+
+
+def _copy(source, destination, length):
+    """Copy length bytes between open files in CHUNK_BYTES pieces."""
+    while length > 0:
+        data = source.read(min(CHUNK_BYTES, length))
+        if not data:
+            break
+        destination.write(data)
+        length -= len(data)
+
+
+def _wav_layout(f):
+    """
+    Read a RIFF/WAVE header and leave f at the start of the samples.
+
+    Returns:
+        (fmt chunk body, length of the sample data in bytes).
+    """
+    header = f.read(12)
+    if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        raise ValueError("Not a WAV file")
+    fmt = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            raise ValueError("WAV file has no data chunk")
+        chunk_id, size = chunk[:4], int.from_bytes(chunk[4:], "little")
+        if chunk_id == b"data":
+            start = f.tell()
+            end = f.seek(0, os.SEEK_END)
+            # Streamed WAV leaves the length 0 or at its maximum
+            if size == 0 or start + size > end:
+                size = end - start
+            f.seek(start)
+            return fmt, size
+        body = f.read(size + (size & 1))
+        if chunk_id == b"fmt ":
+            fmt = body[:size]
+
+
+def join_wav_files(paths, output_file):
+    """
+    Concatenate WAV files with the same sample format into one, copying the
+    samples in chunks and writing the sizes once they are known.
+    """
+    fmt, total = None, 0
+    with open(output_file, "wb") as out:
+        for path in paths:
+            with open(path, "rb") as f:
+                part_fmt, size = _wav_layout(f)
+                if fmt is None:
+                    fmt = part_fmt
+                    out.write(b"RIFF\0\0\0\0WAVEfmt " + len(fmt).to_bytes(4, "little"))
+                    out.write(fmt + b"\0" * (len(fmt) & 1) + b"data\0\0\0\0")
+                elif part_fmt != fmt:
+                    raise ValueError("Cannot join WAV files with different sample formats")
+                _copy(f, out, size)
+                total += size
+        if fmt is None:
+            raise ValueError("No audio to join")
+        if total & 1:
+            out.write(b"\0")
+        data_offset = 20 + len(fmt) + (len(fmt) & 1)
+        out.seek(data_offset + 4)
+        out.write(total.to_bytes(4, "little"))
+        out.seek(4)
+        out.write((data_offset + 8 + total + (total & 1) - 8).to_bytes(4, "little"))
+
+
+_OGG_BOS = 0x02
+_OGG_EOS = 0x04
+# Ogg's CRC is CRC-32 without bit reflection; bit-reversing every byte in
+# and the result out maps it onto zlib's reflected CRC-32, which runs in C
+_BIT_REVERSED = bytes(int(f"{byte:08b}"[::-1], 2) for byte in range(256))
+
+
+def ogg_crc(data):
+    """Ogg page checksum (polynomial 0x04C11DB7, initial value 0, no final xor)."""
+    crc = zlib.crc32(bytes(data).translate(_BIT_REVERSED), 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return int(f"{crc:032b}"[::-1], 2)
+
+
+def _iter_ogg_pages(f):
+    """Yield (flags, granule, serial, lacing, body) for every page of an Ogg stream."""
+    while True:
+        header = f.read(27)
+        if len(header) < 27:
+            return
+        if header[:4] != b"OggS":
+            raise ValueError("Not an Ogg stream")
+        lacing = f.read(header[26])
+        yield (header[5], int.from_bytes(header[6:14], "little", signed=True),
+               int.from_bytes(header[14:18], "little"), lacing, f.read(sum(lacing)))
+
+
+def ogg_page(flags, granule, serial, sequence, lacing, body):
+    """One Ogg page with its checksum; lacing is the segment table."""
+    page = bytearray(b"OggS\0" + bytes([flags]) + granule.to_bytes(8, "little", signed=True)
+                     + serial.to_bytes(4, "little") + sequence.to_bytes(4, "little")
+                     + b"\0\0\0\0" + bytes([len(lacing)]) + lacing + body)
+    page[22:26] = ogg_crc(page).to_bytes(4, "little")
+    return bytes(page)
+
+
+def join_ogg_files(paths, output_file, header_packets=2):
+    """
+    Merge Ogg Opus files into one logical stream, page by page.
+
+    The identification and comment headers are kept from the first file
+    only; the pages of the others are renumbered into the first stream and
+    their granule positions shifted by the samples before them. Players see
+    one continuous stream rather than a chain, which browsers handle badly.
+    """
+    serial = None
+    sequence = 0
+    offset = 0
+    pending = None  # the latest page, written once it is known not to be the last
+
+    with open(output_file, "wb") as out:
+        def emit(page, last=False):
+            nonlocal sequence
+            flags, granule, lacing, body = page
+            flags &= ~_OGG_EOS
+            if sequence:
+                flags &= ~_OGG_BOS
+            if last:
+                flags |= _OGG_EOS
+            out.write(ogg_page(flags, granule, serial, sequence, lacing, body))
+            sequence += 1
+
+        for index, path in enumerate(paths):
+            with open(path, "rb") as f:
+                headers_left = header_packets
+                end_granule = 0
+                for flags, granule, page_serial, lacing, body in _iter_ogg_pages(f):
+                    if serial is None:
+                        serial = page_serial
+                    if headers_left > 0:
+                        # Header packets always end on a page boundary
+                        headers_left -= sum(value < 255 for value in lacing)
+                        if index:
+                            continue
+                    elif granule != -1:
+                        end_granule = granule
+                        granule += offset
+                    if pending is not None:
+                        emit(pending)
+                    pending = (flags, granule, lacing, body)
+                offset += end_granule
+        if pending is None:
+            raise ValueError("No audio to join")
+        emit(pending, last=True)
+
+
+class AudioFormat:
+    """
+    An output format of the Text to Speech service, with an optional sample
+    rate in Hz. The service picks the bitrate from the format and rate:
+    Ogg/Opus at 16 or 24 kHz is a fraction of the size of MP3 for speech,
+    and WAV is uncompressed for post-processing.
+
+    Raises:
+        ValueError: For unknown formats or rates Opus does not support.
+    """
+
+    def __init__(self, name="mp3", rate=None):
+        name = name.lower()
+        if name not in FORMATS:
+            raise ValueError(f"Unsupported audio format: {name} "
+                             f"(choose from {', '.join(FORMATS)})")
+        rate = int(rate) if rate else None
+        if name == "ogg" and rate and rate not in OPUS_RATES:
+            raise ValueError(f"Opus supports sample rates {OPUS_RATES}, not {rate}")
+        self.name = name
+        self.rate = rate
+
+    @property
+    def accept(self):
+        """Accept header value requesting this format from the service."""
+        return FORMATS[self.name][0] + (f";rate={self.rate}" if self.rate else "")
+
+    @property
+    def mime_type(self):
+        return FORMATS[self.name][1]
+
+    @property
+    def extension(self):
+        return FORMATS[self.name][2]
+
+    def join(self, paths, output_file):
+        """Join audio files of this format into output_file, in order."""
+        joiners = {"mp3": join_mp3_files, "ogg": join_ogg_files, "wav": join_wav_files}
+        joiners[self.name](paths, output_file)
+
+    def to_dict(self):
+        return {"name": self.name, "rate": self.rate}
+
+    def __repr__(self):
+        return f"AudioFormat({self.name!r}, rate={self.rate})"
@@ -0,0 +1,260 @@
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+from collections import Counter
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import metrics
+from audio import FORMATS, AudioFormat
+from checkpoints import CheckpointStore
+from model import TONES
+from pipeline import estimate, fingerprint, get_pipeline, narration_key, output_key
+from rate_limit import limits
+from token_budget import BudgetExceeded, check_limits, get_calibration
+from token_manager import get_token_manager
+from tts import ENGLISH_VOICES
+
+MIME_TYPES = {".pdf": "application/pdf", ".txt": "text/plain"}
+_PAGES_RE = re.compile(r"^\s*\d*\s*-?\s*\d*\s*(?:,\s*\d*\s*-?\s*\d*\s*)*$")
+
+
+def _output_name(relative):
+    """Output path of an input relative to where it was found, without suffix."""
+    relative = Path(relative)
+    if relative.is_absolute() or ".." in relative.parts:
+        return Path(relative.stem)
+    return relative.parent / relative.stem
+
+
+def validate_row(row):
+    """
+    Check one manifest row before anything is paid for.
+
+    Returns:
+        List of problems; empty if the row is valid.
+    """
+    problems = []
+    if not row.get("path"):
+        problems.append("missing 'path'")
+    if row.get("tone") and row["tone"] not in TONES:
+        problems.append(f"unknown tone '{row['tone']}' (one of {', '.join(TONES)})")
+    if row.get("voice") and row["voice"] not in ENGLISH_VOICES:
+        problems.append(f"unknown voice '{row['voice']}'")
+    if row.get("pages") and not _PAGES_RE.match(row["pages"]):
+        problems.append(f"invalid pages '{row['pages']}'")
+    return problems
+
+
+def collect_inputs(paths, manifest=None):
+    """
+    Build the list of conversions from files, directories and a manifest.
+
+    A manifest is a CSV file with a 'path' column and optional 'tone',
+    'voice' and 'pages' columns overriding the command-line defaults.
+    Relative paths in a manifest are resolved against the manifest's folder.
+
+    Outputs mirror each input's path relative to the directory or manifest
+    it came from, so same-named files in different folders do not collide.
+
+    Returns:
+        List of dicts with 'path', 'output' and any per-file overrides.
+
+    Raises:
+        ValueError: If manifest rows are invalid, listing every one by row
+            number, or if two inputs would write the same output.
+    """
+    items = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            items.extend({"path": p, "output": _output_name(p.relative_to(path))}
+                         for p in sorted(path.rglob("*"))
+                         if p.suffix.lower() in MIME_TYPES)
+        else:
+            items.append({"path": path, "output": Path(path.stem)})
+
+    if manifest:
+        manifest = Path(manifest)
+        problems = []
+        with open(manifest, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                item = {k: v.strip() for k, v in row.items() if k and v and v.strip()}
+                row_problems = validate_row(item)
+                if row_problems:
+                    problems.append(f"{manifest}, row {reader.line_num}: "
+                                    f"{'; '.join(row_problems)}")
+                    continue
+                item["output"] = _output_name(item["path"])
+                item["path"] = manifest.parent / item["path"]
+                items.append(item)
+        if problems:
+            raise ValueError("Invalid manifest rows:\n" + "\n".join(problems))
+
+    outputs = Counter(item["output"] for item in items)
+    collisions = [str(item["path"]) for item in items if outputs[item["output"]] > 1]
+    if collisions:
+        raise ValueError("Inputs would write the same output file: " + ", ".join(collisions))
+    return items
+
+
+def convert_file(item, args, watsonx_api_key, tts_api_key):
+    """Run extract -> narrate -> synthesize for one file and report on it."""
+    path = Path(item["path"])
+    tone = item.get("tone", args.tone)
+    voice = item.get("voice", args.voice)
+    audio_format = AudioFormat(args.format, args.sample_rate)
+    output_file = Path(args.output_dir) / f"{item['output']}{audio_format.extension}"
+    report = {"path": str(path), "tone": tone, "voice": voice,
+              "output_file": str(output_file) if tts_api_key else None}
+    started = time.time()
+
+    try:
+        if args.skip_existing and output_file.exists():
+            report["status"] = "skipped"
+            return report
+
+        mime_type = MIME_TYPES.get(path.suffix.lower())
+        if mime_type is None:
+            raise ValueError(f"Unsupported file type: {path.suffix}")
+        data = path.read_bytes()
+        text, cleanup_stats = get_pipeline().extract(
+            data, mime_type, pages=item.get("pages", args.pages),
+            source_fingerprint=fingerprint(data))
+        if not text.strip():
+            raise ValueError("No text found in file.")
+
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        streaming = not args.no_streaming
+        report["estimate"] = estimate(text, tone, streaming, args.request_workers)
+        if args.estimate_only:
+            report["status"] = "estimated"
+            print(f"📊 {path.name}: {report['estimate']['watsonx_tokens']:,} WatsonX tokens, "
+                  f"{report['estimate']['tts_chars']:,} TTS characters, "
+                  f"~{report['estimate']['seconds']:,.0f}s")
+            return report
+        check_limits(report["estimate"], args.max_tokens, args.max_seconds)
+
+        # A rerun after a crash or failure resumes from the finished parts
+        checkpoint = CheckpointStore(
+            output_key(text, tone, voice, audio_format) if tts_api_key
+            else narration_key(text, tone))
+        narration = get_pipeline().run(
+            text, tone, voice, tts_api_key, output_file,
+            get_token_manager(watsonx_api_key).get_bearer,
+            streaming=streaming,
+            max_workers=args.request_workers,
+            checkpoint=checkpoint,
+            audio_format=audio_format)
+        checkpoint.clear()
+
+        with open(output_file.with_suffix(".json"), "w", encoding="utf-8") as f:
+            json.dump(narration, f, ensure_ascii=False, indent=2)
+
+        report.update({
+            "status": "done",
+            "input_chars": len(text),
+            "cleanup_saved_chars": cleanup_stats["saved_chars"],
+            "segments": len(narration),
+            "speech_chars": sum(len(obj["speech_text"]) for obj in narration),
+        })
+        print(f"✅ {path.name}: {len(narration)} segments")
+    except BudgetExceeded as e:
+        report.update({"status": "skipped", "error": str(e)})
+        print(f"⏭️ {path.name}: {e}")
+    except Exception as e:
+        report.update({"status": "failed", "error": str(e)})
+        print(f"❌ {path.name}: {e}")
+    finally:
+        report["seconds"] = round(time.time() - started, 2)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert a directory or manifest of PDF/TXT files to audiobooks.")
+    parser.add_argument("inputs", nargs="*", help="Files or directories to convert")
+    parser.add_argument("--manifest", help="CSV with path[,tone,voice,pages] columns")
+    parser.add_argument("--output-dir", default="audiobooks", help="Where to write outputs")
+    parser.add_argument("--tone", default="Neutral", choices=TONES, help="Default narration tone")
+    parser.add_argument("--voice", default="allison_expressive",
+                        choices=sorted(ENGLISH_VOICES), help="Default voice")
+    parser.add_argument("--format", default=os.getenv("ECHOVERSE_AUDIO_FORMAT", "mp3"),
+                        choices=sorted(FORMATS), help="Audio format (ogg is Opus)")
+    parser.add_argument("--sample-rate", type=int, default=os.getenv("ECHOVERSE_AUDIO_RATE"),
+                        help="Audio sample rate in Hz, e.g. 24000")
+    parser.add_argument("--pages", help="Default PDF page selection, e.g. 1-10")
+    parser.add_argument("--file-workers", type=int, default=2,
+                        help="Files converted at once")
+    parser.add_argument("--request-workers", type=int,
+                        help="Cap on concurrent WatsonX/TTS requests per file "
+                             "(default: adapted to the services' rate limits)")
+    parser.add_argument("--no-streaming", action="store_true",
+                        help="Wait for complete narration before synthesis")
+    parser.add_argument("--skip-existing", action="store_true",
+                        help="Skip files whose audio already exists")
+    parser.add_argument("--max-tokens", type=int,
+                        help="Skip files estimated to need more WatsonX tokens "
+                             "(default: ECHOVERSE_MAX_JOB_TOKENS)")
+    parser.add_argument("--max-seconds", type=float,
+                        help="Skip files estimated to take longer "
+                             "(default: ECHOVERSE_MAX_JOB_SECONDS)")
+    parser.add_argument("--estimate-only", action="store_true",
+                        help="Only report estimated tokens, characters and time")
+    parser.add_argument("--report", help="Summary report path (default: <output-dir>/report.json)")
+    args = parser.parse_args(argv)
+    try:
+        AudioFormat(args.format, args.sample_rate)
+    except ValueError as e:
+        parser.error(str(e))
+
+    watsonx_api_key = os.getenv("WATSONX_API_KEY")
+    tts_api_key = os.getenv("TTS_API_KEY")
+    if not watsonx_api_key:
+        parser.error("WATSONX_API_KEY is not set.")
+    if not tts_api_key:
+        print("⚠️ TTS_API_KEY is missing. Only narration will be produced.")
+
+    try:
+        items = collect_inputs(args.inputs, args.manifest)
+    except ValueError as e:
+        parser.error(str(e))
+    if not items:
+        parser.error("No PDF or TXT files to convert.")
+    Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+
+    print(f"Converting {len(items)} file(s) with {args.file_workers} file worker(s)")
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, args.file_workers)) as pool:
+        reports = list(pool.map(
+            lambda item: convert_file(item, args, watsonx_api_key, tts_api_key), items))
+
+    summary = {
+        "files": len(reports),
+        "done": sum(r["status"] == "done" for r in reports),
+        "skipped": sum(r["status"] == "skipped" for r in reports),
+        "failed": sum(r["status"] == "failed" for r in reports),
+        "estimated": sum(r["status"] == "estimated" for r in reports),
+        "seconds": round(time.time() - started, 2),
+        "estimated_seconds": round(sum(r["estimate"]["seconds"] for r in reports
+                                       if "estimate" in r), 1),
+        "calibration": get_calibration().ratios(),
+        "rate_limits": limits(),
+        "metrics": metrics.snapshot(),
+        "results": reports,
+    }
+    report_path = Path(args.report or Path(args.output_dir) / "report.json")
+    report_path.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+    print(f"\n📊 {summary['done']} done, {summary['skipped']} skipped, "
+          f"{summary['failed']} failed in {summary['seconds']}s")
+    print(f"📝 Report saved as {report_path}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
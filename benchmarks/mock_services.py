@@ -0,0 +1,296 @@
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse
+
+# The app's Ogg page writer, so the mock's checksums cost what the client's do
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from audio import ogg_page  # noqa: E402
+
+EMOTIONS = ["HAPPY", "SAD", "ANGRY", "FEAR", "SUPRISE", "DISGUST"]
+BACKGROUNDS = ["", "OUTDOOR", "INDOOR", "OFFICE"]
+
+# An MPEG 1 Layer III frame at 128 kbps / 44.1 kHz is 417 bytes long
+_FRAME_HEADER = b"\xff\xfb\x90\x64"
+_FRAME_LENGTH = 417
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+class ServiceConfig:
+    """
+    Behaviour of one mocked endpoint.
+
+    Args:
+        latency: Seconds before the first byte of every response.
+        seconds_per_kchar: Extra seconds per 1000 characters of input, to
+            model generation or synthesis time.
+        error_rate: Share of requests answered with error_status.
+        error_status: Status of injected errors, e.g. 429 or 503.
+        retry_after: Retry-After seconds sent with injected errors, if any.
+    """
+
+    def __init__(self, latency=0.05, seconds_per_kchar=0.0, error_rate=0.0,
+                 error_status=503, retry_after=None):
+        self.latency = latency
+        self.seconds_per_kchar = seconds_per_kchar
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def narrate(text, sentences_per_object=2):
+    """Deterministic stand-in for the model's emotion objects."""
+    sentences = [s for s in _SENTENCE_RE.split(text.strip()) if s]
+    objects = []
+    for i in range(0, len(sentences), sentences_per_object):
+        n = i // sentences_per_object
+        objects.append({
+            "speech_text": " ".join(sentences[i:i + sentences_per_object]),
+            # Runs of the same emotion, as real narrations tend to have
+            "emotion": EMOTIONS[(n // 3) % len(EMOTIONS)],
+            "background": BACKGROUNDS[(n // 5) % len(BACKGROUNDS)],
+        })
+    return objects
+
+
+def _spoken_bytes(text, bytes_per_char):
+    return max(1, len(_TAG_RE.sub("", text)) * bytes_per_char)
+
+
+def fake_mp3(text, bytes_per_char):
+    """Valid MP3 frames whose total size is proportional to the spoken text."""
+    frames = max(1, _spoken_bytes(text, bytes_per_char) // _FRAME_LENGTH)
+    return (_FRAME_HEADER + bytes(_FRAME_LENGTH - 4)) * frames
+
+
+def fake_wav(text, bytes_per_char, rate=22050):
+    """16-bit mono silence, with the unknown-length header of a streamed WAV."""
+    samples = _spoken_bytes(text, bytes_per_char) // 2 * 2
+    fmt = (1).to_bytes(2, "little") + (1).to_bytes(2, "little") + rate.to_bytes(4, "little") \
+        + (rate * 2).to_bytes(4, "little") + (2).to_bytes(2, "little") + (16).to_bytes(2, "little")
+    return (b"RIFF\xff\xff\xff\xffWAVEfmt " + len(fmt).to_bytes(4, "little") + fmt
+            + b"data\xff\xff\xff\xff" + bytes(samples))
+
+
+def _ogg_page(flags, granule, sequence, packets, serial=0x4563686F):
+    lacing = b"".join(bytes([255] * (len(p) // 255) + [len(p) % 255]) for p in packets)
+    return ogg_page(flags, granule, serial, sequence, lacing, b"".join(packets))
+
+
+def fake_ogg(text, bytes_per_char, packet_bytes=120, packets_per_page=25):
+    """An Ogg Opus stream of 20 ms packets sized to the spoken text."""
+    head = b"OpusHead\x01\x01" + (312).to_bytes(2, "little") + (48000).to_bytes(4, "little") \
+        + bytes(3)
+    tags = b"OpusTags" + (4).to_bytes(4, "little") + b"mock" + bytes(4)
+    pages = [_ogg_page(0x02, 0, 0, [head]), _ogg_page(0, 0, 1, [tags])]
+    packets = max(1, _spoken_bytes(text, bytes_per_char) // packet_bytes)
+    for start in range(0, packets, packets_per_page):
+        count = min(packets_per_page, packets - start)
+        last = start + count >= packets
+        pages.append(_ogg_page(0x04 if last else 0, 312 + (start + count) * 960,
+                               len(pages), [bytes(packet_bytes)] * count))
+    return b"".join(pages)
+
+
+def fake_audio(text, bytes_per_char, accept="audio/mp3"):
+    """Fake audio in the format an Accept header asks for."""
+    if accept.startswith("audio/ogg"):
+        return fake_ogg(text, bytes_per_char), "audio/ogg"
+    if accept.startswith("audio/wav"):
+        rate = re.search(r"rate=(\d+)", accept)
+        return fake_wav(text, bytes_per_char, int(rate.group(1)) if rate else 22050), "audio/wav"
+    return fake_mp3(text, bytes_per_char), "audio/mp3"
+
+
+class MockServices:
+    """
+    Local HTTP server imitating the IAM token endpoint, the WatsonX
+    /ml/v1/text/generation and generation_stream endpoints, and the TTS
+    /v1/synthesize endpoint.
+
+    Args:
+        iam, watsonx, tts: ServiceConfig per service.
+        sentences_per_object: Input sentences per generated emotion object.
+        stream_piece_chars: Characters of generated text per streamed event.
+        audio_bytes_per_char: Audio bytes returned per spoken character.
+        seed: Seed for error injection, so runs are repeatable.
+    """
+
+    def __init__(self, iam=None, watsonx=None, tts=None, sentences_per_object=2,
+                 stream_piece_chars=64, audio_bytes_per_char=1000, seed=0):
+        self.configs = {
+            "iam": iam or ServiceConfig(latency=0.01),
+            "watsonx": watsonx or ServiceConfig(),
+            "tts": tts or ServiceConfig(),
+        }
+        self.sentences_per_object = sentences_per_object
+        self.stream_piece_chars = stream_piece_chars
+        self.audio_bytes_per_char = audio_bytes_per_char
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {}
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def environment(self):
+        """Environment variables pointing the app at these mocks."""
+        return {
+            "ECHOVERSE_IAM_URL": f"{self.url}/identity/token",
+            "ECHOVERSE_WATSONX_URL": self.url,
+            "ECHOVERSE_TTS_URL": self.url,
+        }
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts = {}
+
+    def _should_fail(self, config):
+        with self._lock:
+            return self._random.random() < config.error_rate
+
+    def _handler(self):
+        mocks = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _read_body(self):
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def _send(self, status, body, content_type="application/json", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _fail(self, config):
+                headers = {}
+                if config.retry_after is not None:
+                    headers["Retry-After"] = str(config.retry_after)
+                self._send(config.error_status,
+                           json.dumps({"error": "injected by mock"}).encode("utf-8"),
+                           headers=headers)
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                body = self._read_body()
+                service = {
+                    "/identity/token": "iam",
+                    "/ml/v1/text/generation": "watsonx",
+                    "/ml/v1/text/generation_stream": "watsonx",
+                    "/v1/synthesize": "tts",
+                }.get(path)
+                if service is None:
+                    self._send(404, b'{"error": "not found"}')
+                    return
+
+                config = mocks.configs[service]
+                mocks._count(path)
+                time.sleep(config.latency)
+                if mocks._should_fail(config):
+                    mocks._count(f"{path} errors")
+                    self._fail(config)
+                    return
+
+                if service == "iam":
+                    self._token()
+                elif service == "tts":
+                    self._synthesize(config, body)
+                else:
+                    self._generate(config, body, stream=path.endswith("_stream"))
+
+            def _token(self):
+                self._send(200, json.dumps({
+                    "access_token": f"mock-{time.time()}",
+                    "token_type": "Bearer",
+                    "expires_in": 3600,
+                    "expiration": int(time.time()) + 3600,
+                }).encode("utf-8"))
+
+            def _generate(self, config, body, stream):
+                prompt = json.loads(body)["input"]
+                # The document follows the last 'Input:' of the prompt
+                text = prompt.rsplit("Input:", 1)[-1].rsplit("Output:", 1)[0].strip().rstrip("”")
+                generated = json.dumps(narrate(text, mocks.sentences_per_object))
+                delay = config.seconds_per_kchar * len(text) / 1000
+
+                if not stream:
+                    time.sleep(delay)
+                    self._send(200, json.dumps({
+                        "model_id": "mock",
+                        "results": [{"generated_text": generated,
+                                     "generated_token_count": len(generated) // 4,
+                                     "input_token_count": len(prompt) // 4,
+                                     "stop_reason": "eos_token"}],
+                    }).encode("utf-8"))
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                size = mocks.stream_piece_chars
+                pieces = [generated[i:i + size] for i in range(0, len(generated), size)]
+                for n, piece in enumerate(pieces):
+                    time.sleep(delay / len(pieces))
+                    event = json.dumps({"results": [{
+                        "generated_text": piece,
+                        "generated_token_count": (n + 1) * size // 4,
+                        "input_token_count": len(prompt) // 4,
+                    }]})
+                    self._chunk(f"id: {n}\nevent: message\ndata: {event}\n\n".encode("utf-8"))
+                self._chunk(b"")
+
+            def _chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def _synthesize(self, config, body):
+                text = json.loads(body)["text"]
+                time.sleep(config.seconds_per_kchar * len(text) / 1000)
+                audio, content_type = fake_audio(text, mocks.audio_bytes_per_char,
+                                                 self.headers.get("Accept") or "audio/mp3")
+                self._send(200, audio, content_type=content_type)
+
+        return Handler
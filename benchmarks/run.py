@@ -0,0 +1,365 @@
+"""
+Offline benchmarks of the extract -> narrate -> render -> synthesize
+pipeline against local stand-ins for IAM, WatsonX and TTS.
+
+    python benchmarks/run.py --sizes small,medium --repeat 3
+    python benchmarks/run.py --compare benchmarks/results/<earlier>.json
+
+Results are written as JSON so runs from different commits can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+from pathlib import Path
+
+from mock_services import MockServices, ServiceConfig
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+RESULTS_VERSION = 1
+
+# Approximate characters of source text per document size
+SIZES = {"small": 4_000, "medium": 20_000, "large": 80_000}
+STAGES = ["extraction", "narration", "narration_streaming", "rendering",
+          "synthesis", "end_to_end", "end_to_end_cached"]
+
+TONE = "Dramatic"
+VOICE = "allison_expressive"
+API_KEY = "mock-key"
+
+_WORDS = (
+    "the wind sun traveller road shawl morning river city light shadow house "
+    "garden letter window voice story music silence winter summer memory door "
+    "friend stranger journey promise answer question market harbour mountain "
+    "forest walked whispered laughed waited remembered carried opened watched "
+    "slowly quietly suddenly again never always perhaps together alone bright "
+    "cold warm old new small great last first"
+).split()
+LINE_WIDTH = 90
+LINES_PER_PAGE = 55
+
+
+def make_document(chars, seed=0):
+    """Deterministic paragraphs of prose of about the given length."""
+    rng = random.Random(seed)
+    paragraphs = []
+    total = 0
+    while total < chars:
+        sentences = []
+        for _ in range(rng.randint(3, 7)):
+            words = rng.choices(_WORDS, k=rng.randint(8, 20))
+            words[0] = words[0].capitalize()
+            sentences.append(" ".join(words) + rng.choice(".....?!"))
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        total += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def _pdf_escape(line):
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(text, title="A Benchmark Book"):
+    """
+    A minimal text PDF of the document, with a running header and page
+    numbers on every page so the cleanup step has work to do.
+    """
+    lines = []
+    for paragraph in text.split("\n\n"):
+        lines.extend(textwrap.wrap(paragraph, LINE_WIDTH))
+        lines.append("")
+    pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)]
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for number, page in enumerate(pages, start=1):
+        body = [title, ""] + page + ["", f"Page {number}"]
+        ops = " ".join(f"({_pdf_escape(line)}) '" for line in body)
+        stream = f"BT /F1 9 Tf 12 TL 40 810 Td {ops} ET".encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, obj)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, xref)
+    return bytes(out), len(pages)
+
+
+def summarize(times):
+    return {
+        "runs": len(times),
+        "min": round(min(times), 4),
+        "median": round(statistics.median(times), 4),
+        "mean": round(statistics.mean(times), 4),
+    }
+
+
+class Bench:
+    """Runs the stages for one document size and collects result rows."""
+
+    def __init__(self, mocks, size, text, pdf, pages, repeat, workdir):
+        self.mocks = mocks
+        self.size = size
+        self.text = text
+        self.pdf = pdf
+        self.pages = pages
+        self.repeat = repeat
+        self.workdir = Path(workdir)
+        self.rows = []
+
+    def measure(self, stage, fn, chars=None):
+        """Time fn() repeat times and record a row; returns the last result."""
+        self.mocks.reset_counts()
+        times = []
+        extra = {}
+        result = None
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            result = fn(extra)
+            times.append(time.perf_counter() - started)
+        seconds = summarize(times)
+        chars = len(self.text) if chars is None else chars
+        row = {
+            "size": self.size,
+            "stage": stage,
+            "chars": chars,
+            "seconds": seconds,
+            "chars_per_second": round(chars / seconds["median"], 1) if seconds["median"] else None,
+            "requests_per_run": {path: count / self.repeat
+                                 for path, count in sorted(self.mocks.counts.items())},
+            **extra,
+        }
+        self.rows.append(row)
+        print(f"  {stage:<22} median {seconds['median']:8.3f}s  "
+              f"{row['chars_per_second'] or 0:>12,.0f} chars/s")
+        return result
+
+    def run(self, stages):
+        # App modules read their endpoints and cache paths at import time,
+        # so they are imported only once the environment points at the mocks
+        from extract import iter_text
+        from model import genrate_reader_json, narration_cache, stream_reader_json
+        from normalize import normalize_pages
+        from pipeline import Pipeline
+        from token_manager import get_token_manager
+        from tts import OUTPUT_FORMAT, audio_cache, render_batches, synthesize_batches
+
+        get_bearer = get_token_manager(API_KEY).get_bearer
+        output_file = self.workdir / f"{self.size}{OUTPUT_FORMAT.extension}"
+        narration = None
+        batches = None
+
+        if "extraction" in stages:
+            def extraction(extra):
+                pages = [page for _, page in iter_text(self.pdf, "application/pdf")]
+                text, stats = normalize_pages(pages)
+                extra.update(pages=self.pages, cleanup_saved_chars=stats["saved_chars"])
+                return text
+            self.measure("extraction", extraction)
+
+        if "narration" in stages or "rendering" in stages or "synthesis" in stages:
+            def narrate(extra):
+                return genrate_reader_json(self.text, TONE, get_bearer, use_cache=False)
+            narration = self.measure("narration", narrate)
+
+        if "narration_streaming" in stages:
+            def narrate_streaming(extra):
+                started = time.perf_counter()
+                objects = []
+                for obj in stream_reader_json(self.text, TONE, get_bearer, use_cache=False):
+                    if not objects:
+                        extra.setdefault("first_object_seconds", []).append(
+                            round(time.perf_counter() - started, 4))
+                    objects.append(obj)
+                return objects
+            self.measure("narration_streaming", narrate_streaming)
+
+        speech_chars = sum(len(obj["speech_text"]) for obj in narration or [])
+
+        if "rendering" in stages or "synthesis" in stages:
+            def render(extra):
+                result = list(render_batches(narration, VOICE))
+                extra["batches"] = len(result)
+                return result
+            batches = self.measure("rendering", render, chars=speech_chars)
+
+        if "synthesis" in stages:
+            def synthesize(extra):
+                synthesize_batches(batches, output_file, VOICE, API_KEY, use_cache=False)
+                extra["audio_bytes"] = output_file.stat().st_size
+            self.measure("synthesis", synthesize, chars=speech_chars)
+
+        if "end_to_end" in stages:
+            def end_to_end(extra):
+                narration_cache.clear()
+                audio_cache.clear()
+                Pipeline().run(self.text, TONE, VOICE, API_KEY, output_file,
+                               get_bearer, streaming=True)
+            self.measure("end_to_end", end_to_end)
+
+        if "end_to_end_cached" in stages:
+            # Fresh in-memory memo, warm disk caches: a repeat of a known book
+            Pipeline().run(self.text, TONE, VOICE, API_KEY, output_file,
+                           get_bearer, streaming=True)
+
+            def end_to_end_cached(extra):
+                Pipeline().run(self.text, TONE, VOICE, API_KEY, output_file,
+                               get_bearer, streaming=True)
+            self.measure("end_to_end_cached", end_to_end_cached)
+
+        return self.rows
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results, threshold):
+    """
+    Print the median change of every (size, stage) found in both runs.
+
+    Returns:
+        Rows that got slower by more than threshold (a fraction).
+    """
+    before = {(row["size"], row["stage"]): row for row in baseline["results"]}
+    regressions = []
+    print(f"\nCompared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for row in results:
+        old = before.get((row["size"], row["stage"]))
+        if old is None:
+            continue
+        change = row["seconds"]["median"] / old["seconds"]["median"] - 1 \
+            if old["seconds"]["median"] else 0.0
+        flag = "⚠️" if change > threshold else "  "
+        print(f"  {flag} {row['size']:<7} {row['stage']:<22} "
+              f"{old['seconds']['median']:8.3f}s -> {row['seconds']['median']:8.3f}s "
+              f"({change:+.1%})")
+        if change > threshold:
+            regressions.append(row)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline against local IAM/WatsonX/TTS mocks.")
+    parser.add_argument("--sizes", default="small,medium",
+                        help=f"Comma-separated document sizes from {', '.join(SIZES)}")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help="Comma-separated stages to run")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Mock WatsonX/TTS seconds before responding")
+    parser.add_argument("--generation-seconds-per-kchar", type=float, default=0.2,
+                        help="Mock WatsonX generation time per 1000 input chars")
+    parser.add_argument("--synthesis-seconds-per-kchar", type=float, default=0.1,
+                        help="Mock TTS synthesis time per 1000 input chars")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Share of WatsonX/TTS requests failing with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float, help="Retry-After sent with errors")
+    parser.add_argument("--audio-bytes-per-char", type=int, default=1000,
+                        help="Mock audio size per spoken character")
+    parser.add_argument("--format", default="mp3", choices=["mp3", "ogg", "wav"],
+                        help="Audio format requested from the TTS mock")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/)")
+    parser.add_argument("--compare", help="Earlier results file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Slowdown, as a fraction, reported as a regression")
+    args = parser.parse_args(argv)
+
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES] + [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"Unknown size or stage: {', '.join(unknown)}")
+
+    def service(seconds_per_kchar):
+        return ServiceConfig(latency=args.latency, seconds_per_kchar=seconds_per_kchar,
+                             error_rate=args.error_rate, error_status=args.error_status,
+                             retry_after=args.retry_after)
+
+    mocks = MockServices(watsonx=service(args.generation_seconds_per_kchar),
+                         tts=service(args.synthesis_seconds_per_kchar),
+                         audio_bytes_per_char=args.audio_bytes_per_char)
+    workdir = tempfile.mkdtemp(prefix="echoverse_bench_")
+    with mocks:
+        os.environ.update(mocks.environment())
+        os.environ["ECHOVERSE_CACHE_DIR"] = str(Path(workdir) / "cache")
+        os.environ["ECHOVERSE_CHECKPOINT_DIR"] = str(Path(workdir) / "checkpoints")
+        os.environ["ECHOVERSE_AUDIO_FORMAT"] = args.format
+        sys.path.insert(0, str(ROOT))
+
+        rows = []
+        for size in sizes:
+            text = make_document(SIZES[size])
+            pdf, pages = make_pdf(text)
+            print(f"\n📚 {size}: {len(text):,} chars, {pages} pages")
+            rows.extend(Bench(mocks, size, text, pdf, pages, args.repeat, workdir).run(stages))
+
+        from metrics import snapshot
+        from rate_limit import limits
+        rate_limits = limits()
+        spans = snapshot()
+
+    results = {
+        "version": RESULTS_VERSION,
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {
+            "repeat": args.repeat,
+            "format": args.format,
+            "mocks": {name: config.to_dict() for name, config in mocks.configs.items()},
+            "audio_bytes_per_char": args.audio_bytes_per_char,
+        },
+        "rate_limits": rate_limits,
+        "metrics": spans,
+        "results": rows,
+    }
+    output = Path(args.output) if args.output else \
+        RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{results['commit'] or 'local'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(f"\n📝 Results saved as {output}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        if compare(baseline, rows, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
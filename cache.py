@@ -0,0 +1,172 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+import metrics
+
+CACHE_ROOT = Path(os.getenv("ECHOVERSE_CACHE_DIR", ".echoverse_cache"))
+
+
+def normalize_text(text):
+    """Normalize text so trivially different copies share a cache entry."""
+    text = unicodedata.normalize("NFC", text)
+    return " ".join(text.split())
+
+
+def make_key(*parts):
+    """Build a stable hex digest from an ordered sequence of key parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Size-bounded, least-recently-used key/value store backed by one file per
+    entry. Entries are written atomically so several processes may share a
+    directory; recency is tracked through file modification times.
+
+    Args:
+        directory: Folder holding the cache entries.
+        max_bytes: Total size budget; oldest entries are evicted beyond it.
+        ttl: Optional lifetime in seconds after which entries are ignored.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, ttl=None):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._index = None  # key -> (size, last_used)
+
+    def _path(self, key):
+        return self.directory / key[:2] / key
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        if not self.directory.exists():
+            return
+        for path in self.directory.glob("*/*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            self._index[path.name] = (stat.st_size, stat.st_mtime)
+
+    def get(self, key):
+        """Return the bytes stored under key, or None on a miss."""
+        return self._lookup(key, Path.read_bytes)
+
+    def copy_to(self, key, destination):
+        """
+        Copy the entry under key to the file destination without loading it
+        into memory. Returns False on a miss.
+        """
+        return self._lookup(key, lambda path: shutil.copyfile(path, destination)) is not None
+
+    def _lookup(self, key, read):
+        result = self._read(key, read)
+        metrics.count("cache_lookups", cache=self.directory.name,
+                      result="miss" if result is None else "hit")
+        return result
+
+    def _read(self, key, read):
+        path = self._path(key)
+        with self._lock:
+            self._load_index()
+            try:
+                stat = path.stat()
+                if self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                    self._remove(key)
+                    self.misses += 1
+                    return None
+                result = read(path)
+            except OSError:
+                self._index.pop(key, None)
+                self.misses += 1
+                return None
+
+            now = time.time()
+            if self.ttl is None:
+                # Bump recency for LRU; with a TTL the mtime is the write time
+                try:
+                    os.utime(path, (now, now))
+                except OSError:
+                    pass
+            self._index[key] = (stat.st_size, now)
+            self.hits += 1
+            return result
+
+    def set(self, key, data):
+        """Store bytes under key, evicting old entries to stay within budget."""
+        self._store(key, lambda tmp_path: tmp_path.write_bytes(data))
+
+    def set_file(self, key, source):
+        """Store a copy of the file source under key, see set()."""
+        self._store(key, lambda tmp_path: shutil.copyfile(source, tmp_path))
+
+    def _store(self, key, write):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        write(tmp_path)
+        size = tmp_path.stat().st_size
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._load_index()
+            self._index[key] = (size, time.time())
+            self._evict()
+
+    def _remove(self, key):
+        try:
+            self._path(key).unlink()
+        except OSError:
+            pass
+        self._index.pop(key, None)
+
+    def _evict(self):
+        total = sum(size for size, _ in self._index.values())
+        if total <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= size
+            self.evictions += 1
+            metrics.count("cache_evictions", cache=self.directory.name)
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._load_index()
+            for key in list(self._index):
+                self._remove(key)
+
+    def stats(self):
+        """Return hit/miss/eviction counters and current usage."""
+        with self._lock:
+            self._load_index()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._index),
+                "bytes": sum(size for size, _ in self._index.values()),
+            }
@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+CHECKPOINT_ROOT = Path(os.getenv("ECHOVERSE_CHECKPOINT_DIR", ".echoverse_checkpoints"))
+
+
+class CheckpointStore:
+    """
+    Durable record of the units of one conversion that already finished:
+    narrated chunks and synthesized segments, each stored under the same
+    content key the caches use.
+
+    Unlike the caches nothing is evicted while the conversion is retried,
+    so a crashed, restarted or re-submitted conversion with the same inputs
+    picks up every finished unit and only redoes the rest. The store is
+    cleared once the conversion completes; stores of conversions that are
+    abandoned are removed by expire_checkpoints.
+
+    Args:
+        key: Identifies the conversion, e.g. pipeline.output_key(...).
+        root: Directory holding one sub-directory per conversion.
+    """
+
+    def __init__(self, key, root=CHECKPOINT_ROOT):
+        self.key = key
+        self.directory = Path(root) / key
+        self._lock = threading.Lock()
+
+    def _write(self, path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def get_narration(self, chunk_key):
+        """Return the emotion objects of a finished chunk, or None."""
+        path = self.directory / "narration" / f"{chunk_key}.json"
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def save_narration(self, chunk_key, objects):
+        self._write(self.directory / "narration" / f"{chunk_key}.json",
+                    json.dumps(objects).encode("utf-8"))
+
+    def copy_segment(self, segment_key, destination):
+        """Copy a finished segment's audio to destination; False if missing."""
+        try:
+            shutil.copyfile(self.directory / "segments" / segment_key, destination)
+            return True
+        except OSError:
+            return False
+
+    def save_segment_file(self, segment_key, source):
+        """Record the audio file source as a finished segment."""
+        path = self.directory / "segments" / segment_key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)
+
+    def clear(self):
+        """Remove the checkpoints once the conversion has completed."""
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _last_write(directory):
+    """Latest mtime of a store: its directory or one of its unit directories."""
+    return max([directory.stat().st_mtime] + [child.stat().st_mtime
+                                              for child in directory.iterdir()
+                                              if child.is_dir()])
+
+
+def expire_checkpoints(ttl, keep=(), root=CHECKPOINT_ROOT):
+    """
+    Remove the stores of conversions that wrote nothing for ttl seconds,
+    e.g. ones that failed and were never resumed.
+
+    Args:
+        ttl: Seconds since a store's last write after which it is removed.
+        keep: Keys of conversions still running, whose stores are kept.
+        root: Directory holding one sub-directory per conversion.
+
+    Returns:
+        Number of stores removed.
+    """
+    root = Path(root)
+    if not root.is_dir():
+        return 0
+    cutoff = time.time() - ttl
+    removed = 0
+    for directory in root.iterdir():
+        if not directory.is_dir() or directory.name in keep:
+            continue
+        try:
+            updated = _last_write(directory)
+        except OSError:
+            continue
+        if updated < cutoff:
+            shutil.rmtree(directory, ignore_errors=True)
+            removed += 1
+    if removed:
+        print(f"🧹 Removed {removed} expired checkpoint(s)")
+    return removed
@@ -0,0 +1,187 @@
+import re
+
+# Rough English average used to budget prompts without a tokenizer
+CHARS_PER_TOKEN = 4
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])[\"'”’)\]]*\s+")
+
+
+def estimate_tokens(text):
+    """Cheap token estimate for budgeting chunk sizes."""
+    return max(1, len(text) // CHARS_PER_TOKEN) if text else 0
+
+
+def split_sentences(text):
+    """Split a paragraph into sentences, keeping closing quotes attached."""
+    sentences = []
+    start = 0
+    for match in _SENTENCE_RE.finditer(text):
+        sentences.append(text[start:match.start()] + match.group().rstrip())
+        start = match.end()
+    if start < len(text):
+        sentences.append(text[start:])
+    return [s.strip() for s in sentences if s.strip()]
+
+
+def _split_words(sentence, max_tokens):
+    """Last resort for a single sentence that exceeds the budget."""
+    pieces, current = [], []
+    for word in sentence.split():
+        if current and estimate_tokens(" ".join(current + [word])) > max_tokens:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def _units(text, max_tokens):
+    """Yield (unit, ends_paragraph) pairs no larger than max_tokens."""
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            yield paragraph, True
+            continue
+        sentences = split_sentences(paragraph)
+        for i, sentence in enumerate(sentences):
+            last = i == len(sentences) - 1
+            if estimate_tokens(sentence) <= max_tokens:
+                yield sentence, last
+            else:
+                pieces = _split_words(sentence, max_tokens)
+                for j, piece in enumerate(pieces):
+                    yield piece, last and j == len(pieces) - 1
+
+
+def plan_chunks(text, max_tokens=1500, overlap_sentences=1):
+    """
+    Split text into chunks that each fit a token budget.
+
+    Chunks break on paragraph boundaries where possible, then on sentence
+    boundaries. Each chunk carries the last few sentences of its predecessor
+    as 'context' so the model can keep the narration flowing; the context is
+    not meant to be narrated again.
+
+    Args:
+        text: Document text.
+        max_tokens: Estimated token budget for each chunk's own text.
+        overlap_sentences: Number of trailing sentences passed as context.
+
+    Returns:
+        List of dicts with 'index', 'text' and 'context' keys, in order.
+    """
+    chunks = []
+    current, current_tokens = [], 0
+
+    def flush():
+        if current:
+            chunks.append("".join(current).strip())
+
+    for unit, ends_paragraph in _units(text, max_tokens):
+        unit_tokens = estimate_tokens(unit)
+        if current and current_tokens + unit_tokens > max_tokens:
+            flush()
+            current, current_tokens = [], 0
+        current.append(unit + ("\n\n" if ends_paragraph else " "))
+        current_tokens += unit_tokens + 1
+    flush()
+
+    planned = []
+    for i, chunk in enumerate(chunks):
+        context = ""
+        if i > 0 and overlap_sentences > 0:
+            context = " ".join(split_sentences(chunks[i - 1])[-overlap_sentences:])
+        planned.append({"index": i, "text": chunk, "context": context})
+    return planned
+
+
+# Share of a sentence's words a narration object must contain to cover it
+COVERED_RATIO = 0.5
+# Sentences ahead of the last covered one an object is matched against
+MATCH_WINDOW = 12
+_WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+def _words(text):
+    """
+    Distinctive words of text. Short sentences like "It is I." keep their
+    short words; only text without any word at all gives an empty set.
+    """
+    words = set(_WORD_RE.findall(text.lower()))
+    return {word for word in words if len(word) > 2} or words
+
+
+def _covers(words, sentence_words):
+    return len(sentence_words & words) >= COVERED_RATIO * len(sentence_words)
+
+
+def _sentence_offsets(text):
+    """(start, end) offsets of every sentence of text."""
+    offsets, position = [], 0
+    for sentence in split_sentences(text):
+        start = text.find(sentence, position)
+        if start < 0:
+            continue
+        offsets.append((start, start + len(sentence)))
+        position = start + len(sentence)
+    return offsets
+
+
+def uncovered_spans(text, objects, min_gap=2):
+    """
+    Find the parts of text a narration left out.
+
+    Narration objects paraphrase the source in order, so each object is
+    aligned to the run of source sentences just after the previous match
+    whose words it mostly contains. Sentences no object covers form gaps;
+    sentences without words (e.g. "...") count as covered and never extend
+    one. A gap at the end (a cut-off response) is always reported, one in
+    the middle (a dropped object) only if it spans at least min_gap
+    sentences, since single sentences are often merely paraphrased away.
+
+    Args:
+        text: Source text that was narrated.
+        objects: The emotion objects returned for it.
+        min_gap: Minimum sentences of a gap before the last covered one.
+
+    Returns:
+        List of dicts with 'start' and 'end' offsets into text and 'after',
+        the number of objects that precede the gap.
+    """
+    sentences = _sentence_offsets(text)
+    sentence_words = [_words(text[start:end]) for start, end in sentences]
+    covered_by = [None] * len(sentences)
+
+    position = 0
+    for index, obj in enumerate(objects):
+        words = _words(obj.get("speech_text", ""))
+        window = range(position, min(len(sentences), position + MATCH_WINDOW))
+        first = next((i for i in window
+                      if sentence_words[i] and _covers(words, sentence_words[i])), None)
+        if first is None:
+            continue
+        i = first
+        while i < len(sentences) and _covers(words, sentence_words[i]):
+            covered_by[i] = index
+            i += 1
+        position = i
+
+    spans, gap = [], []
+    for i in [i for i, words in enumerate(sentence_words) if words] + [None]:
+        if i is not None and covered_by[i] is None:
+            gap.append(i)
+            continue
+        if gap:
+            if i is None or len(gap) >= min_gap:
+                previous = [c for c in covered_by[:gap[0]] if c is not None]
+                spans.append({
+                    "start": sentences[gap[0]][0],
+                    "end": sentences[gap[-1]][1],
+                    "after": previous[-1] + 1 if previous else 0,
+                })
+            gap = []
+    return spans
@@ -0,0 +1,101 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfReader
+
+EXTRACT_WORKERS = int(os.getenv("ECHOVERSE_EXTRACT_WORKERS", os.cpu_count() or 1))
+# Smaller documents are extracted in-process; a pool isn't worth starting
+PARALLEL_MIN_PAGES = 16
+PAGES_PER_TASK = 8
+
+# Set once per worker process so the PDF bytes are not re-sent with every task
+_worker_reader = None
+
+
+def parse_page_range(spec, page_count):
+    """
+    Turn a selection like "1-5, 8, 10-" into sorted 0-based page indices.
+    An empty selection means every page.
+
+    Raises:
+        ValueError: If the selection is malformed or out of range.
+    """
+    if not spec or not spec.strip():
+        return list(range(page_count))
+
+    selected = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                start, _, end = part.partition("-")
+                start = int(start) if start.strip() else 1
+                end = int(end) if end.strip() else page_count
+            else:
+                start = end = int(part)
+        except ValueError:
+            raise ValueError(f"Invalid page range '{part}'.") from None
+        if start < 1 or end > page_count or start > end:
+            raise ValueError(f"Invalid page range '{part}' for a {page_count}-page document.")
+        selected.update(range(start - 1, end))
+    return sorted(selected)
+
+
+def _init_worker(data):
+    global _worker_reader
+    _worker_reader = PdfReader(io.BytesIO(data))
+
+
+def _extract_pages(indices):
+    return [(i + 1, _worker_reader.pages[i].extract_text() or "") for i in indices]
+
+
+def iter_pdf_pages(data, pages=None, max_workers=EXTRACT_WORKERS):
+    """
+    Extract text from PDF bytes page by page.
+
+    Large documents are split into runs of pages extracted in parallel on a
+    process pool. Pages are yielded in document order as soon as they and
+    every page before them are ready, so downstream work can start before
+    the whole document is done.
+
+    Args:
+        data: PDF file contents.
+        pages: Optional page selection string, see parse_page_range.
+        max_workers: Number of extraction processes.
+
+    Yields:
+        (page_number, text) tuples with 1-based page numbers.
+    """
+    reader = PdfReader(io.BytesIO(data))
+    indices = parse_page_range(pages, len(reader.pages))
+
+    if len(indices) < PARALLEL_MIN_PAGES or max_workers <= 1:
+        for i in indices:
+            yield i + 1, reader.pages[i].extract_text() or ""
+        return
+
+    tasks = [indices[i:i + PAGES_PER_TASK] for i in range(0, len(indices), PAGES_PER_TASK)]
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks)),
+                             initializer=_init_worker, initargs=(data,)) as pool:
+        for result in pool.map(_extract_pages, tasks):
+            yield from result
+
+
+def iter_text(data, mime_type, pages=None):
+    """
+    Yield (page_number, raw text) for an uploaded PDF or TXT file. A text
+    file is a single page.
+
+    Raises:
+        ValueError: If the file type is not supported.
+    """
+    if mime_type == "application/pdf":
+        yield from iter_pdf_pages(data, pages)
+    elif mime_type == "text/plain":
+        yield 1, data.decode("utf-8")
+    else:
+        raise ValueError("Currently, only PDF and TXT are supported.")
@@ -1,17 +1,35 @@
+import os
 import requests
 from typing import Optional
+import http_client
 
-def get_ibm_iam_bearer(api_key: str, timeout: float = 15.0) -> str:
+IAM_URL = os.getenv("ECHOVERSE_IAM_URL", "https://iam.cloud.ibm.com/identity/token")
+
+
+def build_iam_request(api_key: str):
+    """Return the (headers, form data) pair for an IAM token request."""
+    if not api_key or not api_key.strip():
+        raise ValueError("IBM Cloud API key must be provided.")
+
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    data = {
+        "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
+        "apikey": api_key,
+    }
+    return headers, data
+
+
+def request_iam_token(api_key: str, timeout: float = 15.0) -> dict:
     """
-    Exchange an IBM Cloud API key for an IAM access token and return the
-    'Bearer <token>' string suitable for Authorization headers.
+    Exchange an IBM Cloud API key for an IAM token and return the full
+    response payload, including 'access_token', 'expires_in' and 'expiration'.
 
     Args:
         api_key: Your IBM Cloud API key (from IBM Cloud console).
         timeout: Request timeout in seconds.
 
     Returns:
-        A string like 'Bearer eyJraWQiOi...'
+        The decoded JSON payload from the IAM token endpoint.
 
     Raises:
         ValueError: If api_key is empty.
@@ -19,18 +37,11 @@ def get_ibm_iam_bearer(api_key: str, timeout: float = 15.0) -> str:
         requests.RequestException: For network/timeout issues.
         KeyError: If the token is missing in the response.
     """
-    if not api_key or not api_key.strip():
-        raise ValueError("IBM Cloud API key must be provided.")
-
-    url = "https://iam.cloud.ibm.com/identity/token"
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    data = {
-        "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
-        "apikey": api_key,
-    }
+    headers, data = build_iam_request(api_key)
 
     try:
-        resp = requests.post(url, headers=headers, data=data, timeout=timeout)
+        resp = http_client.post(IAM_URL, headers=headers, data=data, timeout=timeout,
+                                 service="iam")
     except requests.RequestException as e:
         # Network or timeout error
         raise
@@ -48,10 +59,35 @@ def get_ibm_iam_bearer(api_key: str, timeout: float = 15.0) -> str:
         raise http_err
 
     payload = resp.json()
-    access_token = payload.get("access_token")
-    if not access_token:
+    if not payload.get("access_token"):
         raise KeyError(
             f"access_token missing in IAM response: {payload}"
         )
 
-    return f"Bearer {access_token}"
+    return payload
+
+
+def get_ibm_iam_bearer(api_key: str, timeout: float = 15.0) -> str:
+    """
+    Exchange an IBM Cloud API key for an IAM access token and return the
+    'Bearer <token>' string suitable for Authorization headers.
+
+    This always performs a round trip to IAM; prefer
+    token_manager.get_token_manager(api_key).get_bearer() which caches the
+    token until shortly before it expires.
+
+    Args:
+        api_key: Your IBM Cloud API key (from IBM Cloud console).
+        timeout: Request timeout in seconds.
+
+    Returns:
+        A string like 'Bearer eyJraWQiOi...'
+
+    Raises:
+        ValueError: If api_key is empty.
+        requests.HTTPError: For non-2xx responses with details attached.
+        requests.RequestException: For network/timeout issues.
+        KeyError: If the token is missing in the response.
+    """
+    payload = request_iam_token(api_key, timeout=timeout)
+    return f"Bearer {payload['access_token']}"
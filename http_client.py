@@ -0,0 +1,168 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from rate_limit import get_limiter, parse_retry_after
+
+CONNECT_TIMEOUT = float(os.getenv("ECHOVERSE_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.getenv("ECHOVERSE_READ_TIMEOUT", 120))
+MAX_RETRIES = int(os.getenv("ECHOVERSE_MAX_RETRIES", 4))
+# Keep-alive connections kept per host
+POOL_SIZE = int(os.getenv("ECHOVERSE_HTTP_POOL_SIZE", 16))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+
+# Rate limiting and transient server errors are worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the process-wide requests session. Its adapter keeps a pool of
+    keep-alive connections per host, so IAM, WatsonX and TTS calls reuse
+    TCP and TLS connections instead of opening new ones every time.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter for the given retry attempt."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def retry_delay(attempt, retry_after=None):
+    """Wait before a retry, honoring the server's Retry-After if it sent one."""
+    if retry_after is not None:
+        return min(BACKOFF_MAX, retry_after)
+    return backoff_delay(attempt)
+
+
+def request(method, url, retries=MAX_RETRIES, timeout=None, service=None, **kwargs):
+    """
+    Send a request through the shared session, retrying connection errors,
+    timeouts and RETRY_STATUSES responses with jittered exponential backoff.
+
+    Args:
+        method: HTTP method.
+        url: Request URL.
+        retries: Number of retries after the first attempt.
+        timeout: Seconds, or a (connect, read) tuple. Defaults to
+            (CONNECT_TIMEOUT, READ_TIMEOUT).
+        service: Optional service name; every attempt then goes through
+            that service's rate_limit.get_limiter budget. For a streamed
+            response that is returned, the slot is held until the
+            response is closed (e.g. by leaving its with block), so the
+            body's transfer counts against the concurrency limit.
+        **kwargs: Passed on to requests.Session.request.
+
+    Returns:
+        The final requests.Response, which may still be an error response
+        once retries are exhausted.
+
+    Raises:
+        requests.RequestException: If the last attempt failed to connect.
+    """
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    session = get_session()
+    limiter = get_limiter(service) if service else None
+
+    for attempt in range(retries + 1):
+        retry_after = None
+        if limiter:
+            limiter.acquire()
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if limiter:
+                limiter.release()
+            if attempt == retries:
+                raise
+            print(f"🔄 {method} {url} failed ({e}), retrying")
+            metrics.count("retries", service=service or "other", reason=type(e).__name__)
+        else:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            final = response.status_code not in RETRY_STATUSES or attempt == retries
+            if limiter and final and kwargs.get("stream"):
+                _release_on_close(response, limiter, retry_after)
+            elif limiter:
+                limiter.release(response.status_code, retry_after)
+            if final:
+                return response
+            print(f"🔄 {method} {url} returned {response.status_code}, retrying")
+            metrics.count("retries", service=service or "other", reason=response.status_code)
+            response.close()
+        time.sleep(retry_delay(attempt, retry_after))
+
+
+def _release_on_close(response, limiter, retry_after):
+    """Release a streamed response's limiter slot once, when it is closed."""
+    close = response.close
+    released = threading.Event()
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if not released.is_set():
+                released.set()
+                limiter.release(response.status_code, retry_after)
+
+    response.close = close_and_release
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def call_with_retries(fn, retries=MAX_RETRIES, service=None):
+    """
+    Call fn() and retry it with jittered backoff when it raises a transient
+    error. Used for SDK calls that do not go through request(); an exception
+    counts as transient if it is a connection error or timeout, or carries a
+    'code' or 'status_code' in RETRY_STATUSES. service applies a rate
+    limiter as in request().
+    """
+    limiter = get_limiter(service) if service else None
+
+    for attempt in range(retries + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            result = fn()
+        except Exception as e:
+            status = getattr(e, "code", None) or getattr(e, "status_code", None)
+            # SDK errors keep the raw response, and with it any Retry-After
+            http_response = getattr(e, "http_response", None)
+            retry_after = parse_retry_after(
+                http_response.headers.get("Retry-After") if http_response is not None else None)
+            if limiter:
+                limiter.release(status, retry_after)
+            transient = status in RETRY_STATUSES or isinstance(
+                e, (requests.ConnectionError, requests.Timeout))
+            if not transient or attempt == retries:
+                raise
+            print(f"🔄 Transient error ({e}), retrying")
+            metrics.count("retries", service=service or "other",
+                          reason=status or type(e).__name__)
+        else:
+            if limiter:
+                limiter.release(200)
+            return result
+        time.sleep(retry_delay(attempt, retry_after))
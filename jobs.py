@@ -0,0 +1,253 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from audio import AudioFormat
+from checkpoints import CheckpointStore, expire_checkpoints
+from pipeline import estimate, get_pipeline, narration_key, output_key
+from token_budget import check_limits
+from token_manager import get_token_manager
+from tts import OUTPUT_FORMAT
+
+JOBS_ROOT = Path(os.getenv("ECHOVERSE_JOBS_DIR", ".echoverse_jobs"))
+JOB_WORKERS = int(os.getenv("ECHOVERSE_JOB_WORKERS", 4))
+# Seconds a job's directory, and an abandoned conversion's checkpoints, are
+# kept after their last update
+JOB_TTL = float(os.getenv("ECHOVERSE_JOB_TTL", 24 * 3600))
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+INTERRUPTED = "interrupted"
+
+# Stages a running job moves through
+NARRATING = "narrating"
+SYNTHESIZING = "synthesizing"
+FINISHED = "finished"
+
+
+class Job:
+    """
+    State of one audiobook conversion, persisted as job.json in its own
+    directory so the UI, and other processes, can read it while it runs.
+    """
+
+    def __init__(self, job_id, params, directory, key=None, estimate=None):
+        self.id = job_id
+        self.key = key
+        self.params = params
+        self.estimate = estimate
+        self.directory = Path(directory)
+        self.status = QUEUED
+        self.stage = None
+        self.error = None
+        self.narration = []
+        self.narration_done = False
+        self.parts = []
+        self.output_file = None
+        self.created = time.time()
+        self.updated = self.created
+        self._lock = threading.Lock()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "key": self.key,
+                "params": dict(self.params),
+                "estimate": self.estimate,
+                "status": self.status,
+                "stage": self.stage,
+                "error": self.error,
+                "narration": list(self.narration),
+                "narration_done": self.narration_done,
+                "parts": list(self.parts),
+                "output_file": self.output_file,
+                "created": self.created,
+                "updated": self.updated,
+            }
+
+    def update(self, **fields):
+        """Apply fields and persist the job."""
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.updated = time.time()
+        self.save()
+
+    def save(self):
+        state = self.to_dict()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / "job.json"
+        tmp_path = path.with_name(f"job.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+
+class JobManager:
+    """
+    Runs audiobook conversions on a worker pool, outside the Streamlit
+    script thread, and exposes their persisted progress by job id.
+
+    Args:
+        root: Directory holding one sub-directory per job.
+        max_workers: Number of conversions that may run at once.
+        ttl: Seconds a finished job's directory is kept, see cleanup.
+    """
+
+    def __init__(self, root=JOBS_ROOT, max_workers=JOB_WORKERS, ttl=JOB_TTL):
+        self.root = Path(root)
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, text, tone, voice_name, watsonx_api_key, tts_api_key,
+               streaming=True, source_fingerprint=None, audio_format=OUTPUT_FORMAT):
+        """
+        Queue a conversion and return its job id. API keys are only handed
+        to the worker and are never written to disk. source_fingerprint links
+        the job to the uploaded file it came from, see pipeline.fingerprint.
+        audio_format is the audio.AudioFormat of the parts and final file.
+
+        A request whose inputs match a queued, running or finished job returns
+        that job's id instead of starting the work again. Re-submitting the
+        inputs of a failed or interrupted job resumes from its checkpoint.
+
+        Raises:
+            token_budget.BudgetExceeded: If the job's estimated tokens or
+                duration exceed the configured caps.
+        """
+        # Without a TTS key the job only narrates, so only the narration matters
+        key = (output_key(text, tone, voice_name, audio_format) if tts_api_key
+               else narration_key(text, tone))
+        job_estimate = estimate(text, tone, streaming=streaming)
+        with self._lock:
+            self.cleanup()
+            for job in self._jobs.values():
+                if job.key == key and job.status in (QUEUED, RUNNING, DONE):
+                    return job.id
+
+            check_limits(job_estimate)
+            job_id = uuid.uuid4().hex
+            params = {"tone": tone, "voice_name": voice_name, "streaming": streaming,
+                      "source_fingerprint": source_fingerprint,
+                      "audio_format": audio_format.to_dict(),
+                      "mime_type": audio_format.mime_type}
+            job = Job(job_id, params, self.root / job_id, key=key, estimate=job_estimate)
+            self._jobs[job_id] = job
+
+        job.directory.mkdir(parents=True, exist_ok=True)
+        (job.directory / "input.txt").write_text(text, encoding="utf-8")
+        job.save()
+        self._pool.submit(self._run, job, text, watsonx_api_key, tts_api_key)
+        return job_id
+
+    def get(self, job_id):
+        """Return a snapshot dict of the job, or None if it is unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+
+        path = self.root / job_id / "job.json"
+        if not path.exists():
+            return None
+        state = json.loads(path.read_text(encoding="utf-8"))
+        if state["status"] in (QUEUED, RUNNING):
+            # Persisted by a process that is no longer running it
+            state["status"] = INTERRUPTED
+        return state
+
+    def cleanup(self):
+        """
+        Remove the directories of jobs not updated for ttl seconds, and
+        forget them, along with checkpoints not written for ttl seconds.
+        Queued and running jobs of this process, and their checkpoints, are
+        kept. Called with the manager's lock held.
+
+        Returns:
+            Number of job directories removed.
+        """
+        active = {job_id for job_id, job in self._jobs.items()
+                  if job.status in (QUEUED, RUNNING)}
+        expire_checkpoints(self.ttl, keep={self._jobs[job_id].key for job_id in active})
+        if not self.root.is_dir():
+            return 0
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for directory in self.root.iterdir():
+            if not directory.is_dir() or directory.name in active:
+                continue
+            state_file = directory / "job.json"
+            try:
+                updated = (state_file if state_file.exists() else directory).stat().st_mtime
+            except OSError:
+                continue
+            if updated < cutoff:
+                shutil.rmtree(directory, ignore_errors=True)
+                self._jobs.pop(directory.name, None)
+                removed += 1
+        if removed:
+            print(f"🧹 Removed {removed} expired job(s)")
+        return removed
+
+    def _run(self, job, text, watsonx_api_key, tts_api_key):
+        job.update(status=RUNNING, stage=NARRATING)
+
+        def add_narration(obj):
+            with job._lock:
+                job.narration.append(obj)
+
+        def finish_narration():
+            job.update(narration_done=True, stage=SYNTHESIZING)
+
+        audio_format = AudioFormat(**job.params["audio_format"])
+
+        def save_part(index, path):
+            # Parts are synthesized straight into the job directory
+            with job._lock:
+                job.parts.append(Path(path).name)
+            job.save()
+
+        output_file = job.directory / f"audio{audio_format.extension}"
+        # Shared by every job with the same inputs, so a retry resumes the work
+        checkpoint = CheckpointStore(job.key)
+        try:
+            get_pipeline().run(
+                text, job.params["tone"], job.params["voice_name"], tts_api_key,
+                output_file, get_token_manager(watsonx_api_key).get_bearer,
+                streaming=job.params["streaming"],
+                on_narration=add_narration, on_narration_done=finish_narration,
+                on_batch=save_part, checkpoint=checkpoint, audio_format=audio_format,
+                parts_dir=job.directory)
+            checkpoint.clear()
+            job.update(stage=FINISHED, status=DONE,
+                       output_file=output_file.name if tts_api_key else None)
+            # The joined file replaces the parts
+            for part in job.directory.glob("part_*"):
+                part.unlink(missing_ok=True)
+            job.update(parts=[])
+        except Exception as e:
+            print(f"❌ Job {job.id} failed: {e}")
+            job.update(status=FAILED, error=str(e))
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Return the process-wide job manager."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
@@ -1,13 +1,18 @@
 import os
+import time
 import streamlit as st
 import base64
 import io
 from pathlib import Path
-from pypdf import PdfReader
-from model import genrate_reader_json
 from utils import concated_text
-from tts import generate_tts, ENGLISH_VOICES
-from get_token import get_ibm_iam_bearer
+from model import TONES
+from tts import ENGLISH_VOICES
+from jobs import get_job_manager
+from voice_previews import get_preview_library
+from pipeline import fingerprint, get_pipeline
+from normalize import normalize_pages
+from token_budget import BudgetExceeded
+import metrics
 
 
 # ---------------------------
@@ -27,6 +32,14 @@ if not watsonx_api_key:
 if not tts_api_key:
     st.warning("⚠️ TTS_API_KEY is missing. Audio generation will not work.")
 
+# Stream narration objects into TTS as they are generated
+STREAMING = os.getenv("ECHOVERSE_STREAMING", "1") != "0"
+# Seconds between progress refreshes while a job is running
+POLL_SECONDS = float(os.getenv("ECHOVERSE_POLL_SECONDS", 1))
+
+# Prometheus endpoint, when ECHOVERSE_METRICS_PORT is set; started once per server
+metrics.start_http_server()
+
 
 # ---------------------------
 # Load custom CSS
@@ -357,6 +370,14 @@ def render_home_page():
         )
         if uploaded_file:
             st.success(f"✅ File uploaded: {uploaded_file.name}")
+            page_selection = ""
+            if uploaded_file.type == "application/pdf":
+                page_selection = st.text_input(
+                    "Pages",
+                    placeholder="All pages, or e.g. 1-10, 15",
+                    key="page_selection",
+                    help="Only extract the selected pages",
+                )
 
     with col2:
         st.markdown('<div class="card-title">🎯 Tone Selection</div>',
@@ -364,14 +385,7 @@ def render_home_page():
 
         tone = st.selectbox(
             "Select Tone",
-            [
-                "Neutral",
-                "Suspenseful",
-                "Inspiring",
-                "Professional",
-                "Casual",
-                "Dramatic",
-            ],
+            TONES,
             key="tone_select",
         )
 
@@ -414,33 +428,52 @@ def render_home_page():
         else:
             st.info("🎵 Standard voice - clear narration")
 
+        # Samples come from the pre-built library, so auditioning is instant
+        previews = get_preview_library()
+        preview_emotions = previews.emotions(selected_voice)
+        if preview_emotions:
+            preview_emotion = preview_emotions[0]
+            if len(preview_emotions) > 1:
+                preview_emotion = st.selectbox(
+                    "Preview emotion", preview_emotions,
+                    format_func=str.title, key="preview_emotion_select")
+            preview_path = previews.path(selected_voice, preview_emotion)
+            if preview_path is not None:
+                st.audio(str(preview_path), format=previews.audio_format.mime_type)
+        else:
+            st.caption("🔇 No preview yet. Run `python voice_previews.py` to build them.")
+
         st.markdown('<br>', unsafe_allow_html=True)
         if st.button("🎵 Generate Audio", key="generate_btn", type="primary"):
             extracted_text = ""
+            source_fingerprint = None
 
             if text_input.strip():
-                extracted_text = text_input.strip()
+                # Typed text has no pages, so nothing is stripped as a page edge
+                extracted_text, cleanup_stats = normalize_pages([text_input], page_edges=False)
+                if not extracted_text.strip():
+                    st.error("⚠ No text found in the input.")
+                    return
                 st.success("✅ Text input received successfully!")
 
             elif uploaded_file:
                 st.info("📄 Extracting text from uploaded file...")
-                if uploaded_file.type == "application/pdf":
-                    try:
-                        reader = PdfReader(uploaded_file)
-                        text = ""
-                        for page in reader.pages:
-                            text += page.extract_text()
-                        extracted_text = " ".join(text.split("\n"))
-                        st.success("✅ File text extracted successfully!")
-                    except Exception as e:
-                        st.error(f"❌ Error extracting PDF: {e}")
-                        return
-
-                elif uploaded_file.type == "text/plain":
-                    extracted_text = uploaded_file.read().decode("utf-8")
+                extract_status = st.empty()
+                data = uploaded_file.getvalue()
+                source_fingerprint = fingerprint(data)
+                try:
+                    extracted_text, cleanup_stats = get_pipeline().extract(
+                        data, uploaded_file.type,
+                        pages=page_selection,
+                        on_page=lambda n: extract_status.caption(f"Extracted page {n}"),
+                        source_fingerprint=source_fingerprint)
+                    extract_status.empty()
                     st.success("✅ File text extracted successfully!")
-                else:
-                    st.error("Currently, only PDF and TXT are supported.")
+                except ValueError as e:
+                    st.error(str(e))
+                    return
+                except Exception as e:
+                    st.error(f"❌ Error extracting PDF: {e}")
                     return
 
                 if not extracted_text.strip():
@@ -450,8 +483,12 @@ def render_home_page():
                 st.error("Please provide text input or upload a file!")
                 return
 
+            metrics.count("cleanup_saved_chars", cleanup_stats["saved_chars"])
+
             # Store all selections in session state
             st.session_state.original_text = extracted_text
+            st.session_state.cleanup_stats = cleanup_stats
+            st.session_state.source_fingerprint = source_fingerprint
             st.session_state.selected_tone = tone
             st.session_state.selected_voice = selected_voice  # Store selected voice
             st.session_state.page = "output"
@@ -482,77 +519,119 @@ def render_output_page():
             """,
             unsafe_allow_html=True,
         )
-
-    ai_generated_object = None
-    # -------------------- Column 2: Tone-Adapted Narration --------------------
-    with col2:
-        tone = st.session_state.get("selected_tone", "Neutral")
-        selected_voice = st.session_state.get(
-            "selected_voice", "allison_expressive")
-
-        if watsonx_api_key:
-            try:
-                token = get_ibm_iam_bearer(watsonx_api_key)
-                ai_generated_object = genrate_reader_json(original_text, tone, token)
-            except Exception as e:
-                st.error(f"Error generating text: {e}")
-                ai_generated_object = None
-        else:
-             st.error("WATSONX_API_KEY missing. Cannot generate text.")
-             ai_generated_object = None
-
-        if ai_generated_object:
-            print(f"AI Generated Object: {ai_generated_object}")  # Debug
-            print(f"Selected Voice: {selected_voice}")  # Debug
-
-            adapted_text = concated_text(ai_generated_object)
-
-            # Display current settings
-            voice_name = selected_voice.replace('_', ' ').title()
-
-            st.markdown(
-                f"""
-                <div class='content-card'>
-                    <div class='card-title'>🎵 Tone-Adapted Narration</div>
-                    <div style='color: #666; font-size: 12px; margin-bottom: 10px; padding: 5px; background: #f0f0f0; border-radius: 5px;'>
-                        🎯 Tone: <strong>{tone}</strong> | 🎤 Voice: <strong>{voice_name}</strong>
-                    </div>
-                    <div style='color: #1b262c; line-height: 1.6; font-size: 14px; overflow-y: scroll;'>{adapted_text}</div>
+        cleanup_stats = st.session_state.get("cleanup_stats")
+        if cleanup_stats and cleanup_stats["saved_chars"] > 0:
+            st.caption(
+                f"🧹 Cleanup removed {cleanup_stats['saved_chars']:,} characters "
+                f"(headers, footers, page numbers and spacing) before narration.")
+
+    tone = st.session_state.get("selected_tone", "Neutral")
+    selected_voice = st.session_state.get(
+        "selected_voice", "allison_expressive")
+    voice_name = selected_voice.replace('_', ' ').title()
+
+    def render_narration(emotion_objects):
+        adapted_text = concated_text(emotion_objects)
+        st.markdown(
+            f"""
+            <div class='content-card'>
+                <div class='card-title'>🎵 Tone-Adapted Narration</div>
+                <div style='color: #666; font-size: 12px; margin-bottom: 10px; padding: 5px; background: #f0f0f0; border-radius: 5px;'>
+                    🎯 Tone: <strong>{tone}</strong> | 🎤 Voice: <strong>{voice_name}</strong>
                 </div>
-                """,
-                unsafe_allow_html=True,
-            )
-        else:
-            st.warning("No generated content to display.")
-
-    # -------------------- Column 3: Audio Player --------------------
-    with col3:
-        st.info(
-            f"🎵 Generating audio with {selected_voice.replace('_', ' ').title()} voice..."
+                <div style='color: #1b262c; line-height: 1.6; font-size: 14px; overflow-y: scroll;'>{adapted_text}</div>
+            </div>
+            """,
+            unsafe_allow_html=True,
         )
 
-        # Generate and play TTS audio with selected voice
-        audio_file_path = Path("temp_audio.mp3")
+    if not watsonx_api_key:
+        with col2:
+            st.error("WATSONX_API_KEY missing. Cannot generate text.")
+            st.warning("No generated content to display.")
+        job = None
+    else:
+        # Conversions run as background jobs; a rerun only resubmits when the
+        # inputs changed, otherwise it renders the existing job's progress
+        job_inputs = (original_text, tone, selected_voice)
+        job_id = st.session_state.get("job_id")
+        job = get_job_manager().get(job_id) if job_id else None
+        # A job whose directory expired is submitted again
+        if job is None or st.session_state.get("job_inputs") != job_inputs:
+            try:
+                job_id = get_job_manager().submit(
+                    original_text, tone, selected_voice,
+                    watsonx_api_key, tts_api_key, streaming=STREAMING,
+                    source_fingerprint=st.session_state.get("source_fingerprint"))
+            except BudgetExceeded as e:
+                with col2:
+                    st.error(f"❌ {e} Please shorten the text or select fewer pages.")
+                job_id = None
+            st.session_state.job_id = job_id
+            st.session_state.job_inputs = job_inputs
+            job = get_job_manager().get(job_id) if job_id else None
+
+    if job is not None and job["estimate"]:
+        estimate = job["estimate"]
+        with col1:
+            if job["status"] == "done":
+                st.caption(
+                    f"⏱️ Took {job['updated'] - job['created']:,.0f}s "
+                    f"(estimated {estimate['seconds']:,.0f}s).")
+            else:
+                st.caption(
+                    f"📊 Estimated {estimate['watsonx_tokens']:,} WatsonX tokens, "
+                    f"{estimate['tts_chars']:,} TTS characters, "
+                    f"~{estimate['seconds']:,.0f}s.")
 
-        try:
-            # Generate TTS with the selected voice
-            if ai_generated_object and tts_api_key:
-                generate_tts(ai_generated_object, audio_file_path,
-                             voice_name=selected_voice, api_key=tts_api_key)
-            elif not tts_api_key:
-                 st.error("TTS_API_KEY missing. Cannot generate audio.")
-                 pass
+    if job is not None:
+        job_dir = get_job_manager().root / job["id"]
+        in_progress = job["status"] in ("queued", "running")
 
-            if audio_file_path.exists():
-                st.success(f"✅ Audio generated successfully!")
-                audio_bytes = open(audio_file_path, "rb").read()
-                st.audio(audio_bytes, format="audio/mp3")
+        # -------------------- Column 2: Tone-Adapted Narration --------------------
+        with col2:
+            if job["narration"]:
+                render_narration(job["narration"])
+            elif job["status"] == "failed" and not job["narration_done"]:
+                st.error(f"Error generating text: {job['error']}")
+            elif in_progress:
+                st.info("✍️ Narrating...")
             else:
-                st.error("❌ Audio generation failed - file not found.")
+                st.warning("No generated content to display.")
 
-        except Exception as e:
-            st.error(f"❌ Error generating audio: {str(e)}")
-            st.info("Please try again or select a different voice.")
+        # -------------------- Column 3: Audio Player --------------------
+        with col3:
+            if not tts_api_key:
+                st.error("TTS_API_KEY missing. Cannot generate audio.")
+            elif job["output_file"]:
+                st.success(f"✅ Audio generated successfully!")
+                # Handed over by path; Streamlit still reads the file into its
+                # media store to serve it
+                st.audio(str(job_dir / job["output_file"]),
+                         format=job["params"]["mime_type"])
+            elif job["status"] in ("failed", "interrupted"):
+                if job["status"] == "interrupted":
+                    st.error("❌ Audio generation was interrupted.")
+                elif job["narration_done"]:
+                    st.error(f"❌ Error generating audio: {job['error']}")
+                    st.info("Please try again or select a different voice.")
+                # A new job with the same inputs picks up the finished work
+                if st.button("🔁 Resume", key="resume_btn",
+                             help="Continue from the last finished part"):
+                    st.session_state.pop("job_id", None)
+                    st.rerun()
+            else:
+                st.info(
+                    f"🎵 Generating audio with {voice_name} voice..."
+                )
+                # Parts are listed as soon as they are ready, so listening can
+                # start while the rest of the audiobook is still being synthesized
+                for index, part in enumerate(job["parts"]):
+                    if not (job_dir / part).exists():
+                        # Removed because the job finished since the snapshot
+                        break
+                    st.caption(f"▶️ Part {index + 1}")
+                    st.audio(str(job_dir / part), format=job["params"]["mime_type"])
 
     with col3:
         st.markdown('<div class="card-title">⚡ Actions</div>',
@@ -562,8 +641,7 @@ def render_output_page():
         if st.button("🔄 Regenerate", key="regenerate_btn", help="Generate with different settings"):
             new_tone = st.selectbox(
                 "Choose new tone:",
-                ["Neutral", "Suspenseful", "Inspiring",
-                    "Professional", "Casual", "Dramatic"],
+                TONES,
                 key="new_tone_select"
             )
 
@@ -620,6 +698,12 @@ def render_output_page():
         if st.button("📧 Share", key="share_btn"):
             st.info("🔗 Share link generated!")
 
+    # Poll the background job until it finishes; any widget interaction
+    # interrupts the wait and starts a fresh rerun without touching the job
+    if job is not None and job["status"] in ("queued", "running"):
+        time.sleep(POLL_SECONDS)
+        st.rerun()
+
 
 # ---------------------------
 # Page Router
@@ -0,0 +1,249 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from rate_limit import limits
+
+# Append every finished span as one JSON line to this file
+METRICS_LOG = os.getenv("ECHOVERSE_METRICS_LOG")
+# Serve Prometheus text on this port at /metrics
+METRICS_PORT = os.getenv("ECHOVERSE_METRICS_PORT")
+# Interface the metrics server listens on; local only unless set, since the
+# endpoint has no authentication
+METRICS_HOST = os.getenv("ECHOVERSE_METRICS_HOST", "127.0.0.1")
+PREFIX = "echoverse"
+# Upper bounds in seconds of the span duration histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Span:
+    """A timed unit of work; attributes can be added while it runs."""
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = dict(attrs)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, name, amount=1):
+        self.attrs[name] = self.attrs.get(name, 0) + amount
+
+
+class Registry:
+    """
+    Aggregates spans and counters in memory for export.
+
+    Per span name it keeps a count, an error count, a duration histogram and
+    the totals of every numeric attribute (bytes, chars, tokens, ...).
+    Counters are keyed by name and labels, e.g. cache lookups or retries.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._counters = {}
+
+    def observe(self, name, seconds, error=False, attrs=None):
+        with self._lock:
+            stats = self._spans.get(name)
+            if stats is None:
+                stats = self._spans[name] = {
+                    "count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0,
+                    "buckets": [0] * len(BUCKETS), "totals": {},
+                }
+            stats["count"] += 1
+            stats["errors"] += bool(error)
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    stats["buckets"][i] += 1
+            for key, value in (attrs or {}).items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stats["totals"][key] = stats["totals"].get(key, 0) + value
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def snapshot(self):
+        """Plain-dict view of every span and counter, e.g. for reports."""
+        with self._lock:
+            spans = {
+                name: {
+                    "count": s["count"],
+                    "errors": s["errors"],
+                    "seconds": round(s["seconds"], 4),
+                    "mean_seconds": round(s["seconds"] / s["count"], 4),
+                    "max_seconds": round(s["max_seconds"], 4),
+                    **{key: round(value, 4) for key, value in s["totals"].items()},
+                }
+                for name, s in self._spans.items()
+            }
+            counters = [{"name": name, **dict(labels), "value": value}
+                        for (name, labels), value in self._counters.items()]
+        return {"spans": spans, "counters": counters}
+
+    def prometheus(self):
+        """Prometheus text exposition of spans, counters and rate limits."""
+        lines = []
+        with self._lock:
+            spans = {name: dict(s, buckets=list(s["buckets"]), totals=dict(s["totals"]))
+                     for name, s in self._spans.items()}
+            counters = dict(self._counters)
+
+        metric = f"{PREFIX}_span_duration_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for name, s in sorted(spans.items()):
+            label = _labels(span=name)
+            for bound, count in zip(BUCKETS, s["buckets"]):
+                lines.append(f'{metric}_bucket{_labels(span=name, le=bound)} {count}')
+            lines.append(f'{metric}_bucket{_labels(span=name, le="+Inf")} {s["count"]}')
+            lines.append(f"{metric}_sum{label} {s['seconds']}")
+            lines.append(f"{metric}_count{label} {s['count']}")
+
+        lines.append(f"# TYPE {PREFIX}_span_errors_total counter")
+        for name, s in sorted(spans.items()):
+            lines.append(f"{PREFIX}_span_errors_total{_labels(span=name)} {s['errors']}")
+
+        totals = sorted({key for s in spans.values() for key in s["totals"]})
+        for key in totals:
+            metric = f"{PREFIX}_span_{key}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for name, s in sorted(spans.items()):
+                if key in s["totals"]:
+                    lines.append(f"{metric}{_labels(span=name)} {s['totals'][key]}")
+
+        for name in sorted({name for name, _ in counters}):
+            metric = f"{PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f"{metric}{_labels(**dict(labels))} {value}")
+
+        service_limits = limits()
+        for key in ("concurrency_limit", "in_flight", "tokens", "throttled"):
+            metric = f"{PREFIX}_rate_limit_{key}"
+            lines.append(f"# TYPE {metric} gauge")
+            for service, stats in sorted(service_limits.items()):
+                lines.append(f"{metric}{_labels(service=service)} {stats[key]}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+registry = Registry()
+_log_lock = threading.Lock()
+
+
+def _log(record):
+    if not METRICS_LOG:
+        return
+    line = json.dumps(record, default=str)
+    with _log_lock:
+        with open(METRICS_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def observe(name, seconds, error=None, **attrs):
+    """Record a finished span measured by the caller."""
+    registry.observe(name, seconds, error=error is not None, attrs=attrs)
+    record = {"ts": round(time.time() - seconds, 6), "span": name,
+              "seconds": round(seconds, 6), **attrs}
+    if error is not None:
+        record["error"] = error
+    _log(record)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Time the enclosed block as a span called name.
+
+    Yields a Span whose set() and add() attach byte, character or token
+    counts found while the block runs. A span left by an exception is
+    recorded as an error and the exception propagates.
+    """
+    current = Span(name, attrs)
+    started = time.perf_counter()
+    error = None
+    try:
+        yield current
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        observe(name, time.perf_counter() - started, error=error, **current.attrs)
+
+
+def count(name, amount=1, **labels):
+    """Increment a counter such as cache lookups or retries."""
+    registry.count(name, amount, **labels)
+
+
+def snapshot():
+    return registry.snapshot()
+
+
+def render_prometheus():
+    return registry.prometheus()
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_http_server(port=None, host=None):
+    """
+    Serve render_prometheus() at /metrics on port, by default
+    ECHOVERSE_METRICS_PORT, listening on host, by default
+    ECHOVERSE_METRICS_HOST. Does nothing when no port is configured or the
+    server already runs, so it is safe to call on every Streamlit rerun.
+    """
+    global _server
+    port = port or METRICS_PORT
+    host = host or METRICS_HOST
+    if not port:
+        return None
+    with _server_lock:
+        if _server is not None:
+            return _server
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        _server = ThreadingHTTPServer((host, int(port)), Handler)
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+        print(f"📈 Metrics served on {host}:{port}/metrics")
+        return _server
@@ -1,8 +1,22 @@
 from get_token import get_ibm_iam_bearer
-import requests
+from cache import CACHE_ROOT, DiskCache, make_key, normalize_text
+from chunker import plan_chunks, split_sentences, uncovered_spans
+from stream_parser import EmotionObjectParser
+from token_budget import MAX_NEW_TOKENS, max_chunk_tokens, max_new_tokens, record_generation
+from token_manager import invalidate_bearer
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import queue
+import os
+import time
+import http_client
 import json
+import metrics
 
-url = "https://eu-de.ml.cloud.ibm.com/ml/v1/text/generation?version=2023-05-29"
+# Overridable to use another region or a local stand-in (see benchmarks/)
+WATSONX_BASE_URL = os.getenv("ECHOVERSE_WATSONX_URL", "https://eu-de.ml.cloud.ibm.com")
+url = f"{WATSONX_BASE_URL}/ml/v1/text/generation?version=2023-05-29"
+stream_url = f"{WATSONX_BASE_URL}/ml/v1/text/generation_stream?version=2023-05-29"
 
 
 body = {
@@ -94,38 +108,477 @@ Output: [
   }
 ]
 
-Input: {{input}}”
+{{context}}Input: {{input}}”
 Output:""",
     "parameters": {
         "decoding_method": "greedy",
-        "max_new_tokens": 8192,
+        # Upper bound; each request is sized to its input by build_request_body
+        "max_new_tokens": MAX_NEW_TOKENS,
         "min_new_tokens": 0,
-        "stop_sequences": ["]"],
+        # A bare "]" would cut off any speech_text containing one; a JSON
+        # string cannot hold a raw newline, so "\n]" only ends the array
+        "stop_sequences": ["\n]", "\nInput:"],
         "repetition_penalty": 1,
     },
     "model_id": "ibm/granite-3-8b-instruct",
     "project_id": "5261204b-1f60-416e-b589-08790e381d13",
 }
 
-# Removed global headers and get_ibm_iam_bearer call
+# Narration tones offered by the app and the batch converter
+TONES = ["Neutral", "Suspenseful", "Inspiring", "Professional", "Casual", "Dramatic"]
 
-def genrate_reader_json(text, tone, access_token):
-    headers = {
-        "Accept": "application/json",
+# Bump whenever the prompt or response handling changes so cached narrations
+# produced by an older prompt are not reused
+PROMPT_VERSION = "3"
+
+_narration_ttl = os.getenv("ECHOVERSE_NARRATION_CACHE_TTL")
+narration_cache = DiskCache(
+    CACHE_ROOT / "narration",
+    max_bytes=int(os.getenv("ECHOVERSE_NARRATION_CACHE_BYTES", 64 * 1024 * 1024)),
+    ttl=float(_narration_ttl) if _narration_ttl else None,
+)
+
+
+# Input tokens per WatsonX request, and the most requests that may run at
+# once; the 'watsonx' rate limiter decides how many actually do
+CHUNK_TOKENS = int(os.getenv("ECHOVERSE_CHUNK_TOKENS", 1500))
+MAX_WORKERS = int(os.getenv("ECHOVERSE_NARRATION_WORKERS", 16))
+
+# Rounds of re-narrating the parts of a chunk that a cut-off or malformed
+# response left out, before settling for what was salvaged
+RECOVERY_ROUNDS = int(os.getenv("ECHOVERSE_RECOVERY_ROUNDS", 2))
+
+CONTEXT_TEMPLATE = (
+    "Previous text (already narrated, use it only to keep the reading flow "
+    "consistent and do not include it in the output): {context}\n\n"
+)
+
+
+def build_request_body(text, tone, context=""):
+    """
+    Fill the prompt template without mutating the shared body, with a
+    generation budget sized to the text, see token_budget.max_new_tokens.
+    """
+    request_body = copy.deepcopy(body)
+    request_body["parameters"]["max_new_tokens"] = max_new_tokens(text)
+    prompt = request_body["input"].replace("{{tone}}", tone)
+    prompt = prompt.replace(
+        "{{context}}", CONTEXT_TEMPLATE.format(context=context) if context else "")
+    request_body["input"] = prompt.replace("{{input}}", text)
+    return request_body
+
+
+def plan_narration(text, chunk_tokens=CHUNK_TOKENS):
+    """
+    Chunks text will be narrated in. Chunks are kept small enough for their
+    expected narration to fit the model's generation limit. The plan only
+    depends on the text and the configuration, so the same document always
+    splits the same way and its chunks keep hitting the cache.
+    """
+    return plan_chunks(text, max_tokens=min(chunk_tokens, max_chunk_tokens()))
+
+
+def narration_cache_key(text, tone, context=""):
+    return make_key(normalize_text(text), tone, body["model_id"],
+                    PROMPT_VERSION, normalize_text(context))
+
+
+def get_cached_narration(key):
+    """Return the cached emotion objects for key, or None on a miss."""
+    cached = narration_cache.get(key)
+    if cached is not None:
+        return json.loads(cached)
+    return None
+
+
+def store_narration(key, result):
+    narration_cache.set(key, json.dumps(result).encode("utf-8"))
+
+
+def recall_narration(key, use_cache=True, checkpoint=None):
+    """Finished narration for a chunk from the job checkpoint or the cache."""
+    if checkpoint is not None:
+        result = checkpoint.get_narration(key)
+        if result is not None:
+            return result
+    return get_cached_narration(key) if use_cache else None
+
+
+def remember_narration(key, result, use_cache=True, checkpoint=None):
+    if checkpoint is not None:
+        checkpoint.save_narration(key, result)
+    if use_cache:
+        store_narration(key, result)
+
+
+def request_headers(access_token, accept="application/json"):
+    return {
+        "Accept": accept,
         "Content-Type": "application/json",
         "Authorization": access_token
     }
-    
-    body["input"] = body["input"].replace("{{tone}}", tone)
-    body["input"] = body["input"].replace("{{input}}", text)
-    response = requests.post(url, headers=headers, json=body)
-    
-    if not response.ok:
-        raise Exception(f"Error from WatsonX: {response.text}")
-        
-    resp = response.json()["results"][0]["generated_text"]
-
-    return json.loads(resp)
+
+
+def post_generation(target, get_access_token, request_body, accept="application/json",
+                    **kwargs):
+    """
+    POST a generation request to WatsonX. If it answers 401 and the token
+    came from a token manager, the cached token is dropped and the request
+    sent once more with a fresh one.
+    """
+    for attempt in range(2):
+        response = http_client.post(target, headers=request_headers(get_access_token(), accept),
+                                    json=request_body, service="watsonx", **kwargs)
+        if response.status_code != 401 or attempt or not invalidate_bearer(get_access_token):
+            return response
+        response.close()
+        print("🔑 WatsonX rejected the IAM token, retrying with a new one")
+        metrics.count("token_rejections", service="watsonx")
+
+
+def decode_generation(generated_text):
+    """
+    Tolerantly decode generated text, see stream_parser.EmotionObjectParser.
+
+    Returns:
+        (objects, parser); parser.defective tells whether the output was
+        cut off or objects had to be dropped.
+    """
+    parser = EmotionObjectParser()
+    with metrics.span("watsonx.parse", chars=len(generated_text)) as span:
+        objects = parser.feed(generated_text)
+        span.set(objects=len(objects), repaired=parser.repaired,
+                 dropped=len(parser.dropped))
+    return objects, parser
+
+
+def recovery_requests(text, context, objects, parser, recovery_rounds):
+    """
+    The parts of text that objects do not cover, to be narrated again.
+    Only defective output is checked, and only while recovery_rounds are
+    left. Counted in the 'narration_recoveries' metric.
+
+    Returns:
+        List of (span, span_text, span_context) tuples, where span is a
+        chunker.uncovered_spans entry and span_context is the sentence
+        before it (or the chunk's own context for a span at the start).
+    """
+    if not parser.defective or recovery_rounds <= 0:
+        return []
+    requests = []
+    for span in uncovered_spans(text, objects):
+        before = split_sentences(text[:span["start"]])
+        span_context = before[-1] if before else context
+        requests.append((span, text[span["start"]:span["end"]], span_context))
+    if requests:
+        metrics.count("narration_recoveries", len(requests))
+    return requests
+
+
+def splice_recovered(objects, spans, parts):
+    """Insert each span's re-narrated objects where the span belongs."""
+    result = list(objects)
+    for span, part in sorted(zip(spans, parts), key=lambda item: item[0]["after"],
+                             reverse=True):
+        result[span["after"]:span["after"]] = part
+    return result
+
+
+def recovery_failed(error):
+    """
+    Record a span whose re-narration failed. The span is then treated as
+    covered: the chunk keeps what it has rather than failing.
+
+    Returns:
+        The empty list of objects to splice in for the span.
+    """
+    print(f"⚠️ Could not re-narrate an uncovered span: {error}")
+    metrics.count("narration_recovery_failures")
+    return []
+
+
+def is_complete(text, objects, parser):
+    """
+    Whether a chunk's final narration may be cached and checkpointed: output
+    that parsed cleanly, or defective output whose gaps were all recovered.
+    Anything else is used once and requested again next time.
+    """
+    return not parser.defective or not uncovered_spans(text, objects)
+
+
+def finish_narration(key, text, objects, parser, requests, parts, use_cache=True,
+                     checkpoint=None, on_incomplete=None):
+    """
+    Final step of narrating a chunk, shared by the synchronous and async
+    clients: splice the recovered parts in, fail if nothing usable came
+    back, and remember the result only if it is complete.
+
+    Args:
+        key: narration_cache_key of the chunk.
+        text: The chunk's text.
+        objects: Objects decoded from the response.
+        parser: The parser that decoded them.
+        requests: The recovery_requests that were narrated again.
+        parts: Objects narrated for each request, [] for a failed one.
+        use_cache: Store the result in the narration cache.
+        checkpoint: Optional checkpoints.CheckpointStore to record it in.
+        on_incomplete: Optional callable invoked, without arguments, when the
+            result is incomplete and so not remembered.
+
+    Returns:
+        The chunk's emotion objects.
+    """
+    objects = splice_recovered(objects, [span for span, _, _ in requests], parts)
+    if not objects:
+        raise Exception("WatsonX returned no usable narration")
+    if is_complete(text, objects, parser):
+        remember_narration(key, objects, use_cache, checkpoint)
+    else:
+        metrics.count("narration_incomplete")
+        if on_incomplete is not None:
+            on_incomplete()
+    return objects
+
+
+def _narrate_chunk(text, tone, get_access_token, context="", use_cache=True,
+                   checkpoint=None, recovery_rounds=RECOVERY_ROUNDS, on_incomplete=None):
+    key = narration_cache_key(text, tone, context)
+    cached = recall_narration(key, use_cache, checkpoint)
+    if cached is not None:
+        return cached
+
+    request_body = build_request_body(text, tone, context)
+    started = time.perf_counter()
+    with metrics.span("watsonx.generate", input_chars=len(text) + len(context),
+                      max_new_tokens=request_body["parameters"]["max_new_tokens"]) as span:
+        response = post_generation(url, get_access_token, request_body)
+
+        if not response.ok:
+            raise Exception(f"Error from WatsonX: {response.text}")
+
+        payload = response.json()
+        generation = payload["results"][0]
+        span.set(response_bytes=len(response.content),
+                 input_tokens=generation.get("input_token_count", 0),
+                 generated_tokens=generation.get("generated_token_count", 0))
+    record_generation(text, request_body["input"], generation,
+                      time.perf_counter() - started)
+
+    result, parser = decode_generation(generation["generated_text"])
+    # Only the parts the response left out are requested again
+    requests = recovery_requests(text, context, result, parser, recovery_rounds)
+    parts = [_recover_span(span_text, tone, get_access_token, span_context,
+                           use_cache, checkpoint, recovery_rounds - 1, on_incomplete)
+             for _, span_text, span_context in requests]
+    return finish_narration(key, text, result, parser, requests, parts, use_cache,
+                            checkpoint, on_incomplete)
+
+
+def _recover_span(text, tone, get_access_token, context, use_cache, checkpoint,
+                  recovery_rounds, on_incomplete=None):
+    try:
+        return _narrate_chunk(text, tone, get_access_token, context, use_cache,
+                              checkpoint, recovery_rounds, on_incomplete)
+    except Exception as e:
+        return recovery_failed(e)
+
+
+def _stream_chunk(text, tone, get_access_token, context="", use_cache=True,
+                  checkpoint=None, recovery_rounds=RECOVERY_ROUNDS, on_incomplete=None):
+    """
+    Yield emotion objects for one chunk as the model generates them.
+
+    Once an object had to be dropped, the following objects are held back
+    until the stream ends. The parts of the chunk no object covers are then
+    narrated again and spliced in at their place, as in _narrate_chunk,
+    before the held-back objects are yielded. A gap before objects that were
+    already yielded cannot be filled in order; the chunk is then used but
+    not remembered.
+    """
+    key = narration_cache_key(text, tone, context)
+    cached = recall_narration(key, use_cache, checkpoint)
+    if cached is not None:
+        yield from cached
+        return
+
+    request_body = build_request_body(text, tone, context)
+    parser = EmotionObjectParser()
+    result = []
+    yielded = 0
+    # Token counts and the stop reason, as reported by the latest events
+    generation = {}
+    started = time.perf_counter()
+    with metrics.span("watsonx.generate_stream",
+                      input_chars=len(text) + len(context),
+                      max_new_tokens=request_body["parameters"]["max_new_tokens"]) as span, \
+            post_generation(stream_url, get_access_token, request_body,
+                            accept="text/event-stream", stream=True) as response:
+        if not response.ok:
+            raise Exception(f"Error from WatsonX: {response.text}")
+
+        for line in response.iter_lines(decode_unicode=True):
+            # Server-sent events: only 'data:' lines carry generated text
+            if not line or not line.startswith("data:"):
+                continue
+            event = json.loads(line[len("data:"):])
+            span.add("events")
+            for piece in event.get("results", []):
+                generation.update((name, value) for name, value in piece.items()
+                                  if value and name != "generated_text")
+                if piece.get("generated_token_count"):
+                    span.set(generated_tokens=piece["generated_token_count"])
+                parse_started = time.perf_counter()
+                objects = parser.feed(piece.get("generated_text", ""))
+                span.add("parse_seconds", time.perf_counter() - parse_started)
+                for obj in objects:
+                    if not result:
+                        span.set(first_object_seconds=time.perf_counter() - started)
+                    result.append(obj)
+                    # After a dropped object a recovered span may belong
+                    # before the next ones, so they are held back
+                    if not parser.dropped:
+                        yielded += 1
+                        yield obj
+        span.set(objects=len(result))
+    record_generation(text, request_body["input"], generation,
+                      time.perf_counter() - started)
+
+    requests = [(gap, span_text, span_context) for gap, span_text, span_context
+                in recovery_requests(text, context, result, parser, recovery_rounds)
+                if gap["after"] >= yielded]
+    parts = [_recover_span(span_text, tone, get_access_token, span_context,
+                           use_cache, checkpoint, recovery_rounds - 1, on_incomplete)
+             for _, span_text, span_context in requests]
+    yield from finish_narration(key, text, result, parser, requests, parts, use_cache,
+                                checkpoint, on_incomplete)[yielded:]
+
+
+def _is_overlap_repeat(obj, previous):
+    """True if obj repeats one of the objects just before a chunk boundary."""
+    text = normalize_text(obj.get("speech_text", "")).lower()
+    return any(text == normalize_text(p.get("speech_text", "")).lower()
+               for p in previous)
+
+
+def stitch_narrations(parts):
+    """
+    Join per-chunk emotion-object lists in document order, dropping objects
+    the model repeated from the overlap context at a chunk boundary.
+    """
+    stitched = []
+    for part in parts:
+        previous = stitched[-3:]
+        start = 0
+        while start < len(part) and _is_overlap_repeat(part[start], previous):
+            start += 1
+        stitched.extend(part[start:])
+    return stitched
+
+
+def genrate_reader_json(text, tone, access_token, use_cache=True,
+                        max_workers=MAX_WORKERS, chunk_tokens=CHUNK_TOKENS,
+                        checkpoint=None, on_incomplete=None):
+    """
+    Rewrite text as a list of emotion objects using WatsonX.
+
+    Long inputs are split into chunks that fit the token budget, narrated
+    concurrently and stitched back together in document order.
+
+    Args:
+        text: Source text to narrate.
+        tone: Narration tone, e.g. "Dramatic".
+        access_token: 'Bearer <token>' string, or a zero-argument callable
+            returning one. A callable is only invoked on a cache miss.
+        use_cache: Look up and store results in the narration cache.
+        max_workers: Maximum number of concurrent WatsonX requests.
+        chunk_tokens: Estimated input token budget per request.
+        checkpoint: Optional checkpoints.CheckpointStore. Finished chunks are
+            recorded in it and reused when the conversion is resumed.
+        on_incomplete: Optional callable invoked, without arguments, for each
+            chunk or recovered span whose narration stayed incomplete, see
+            finish_narration. It may be called from worker threads.
+
+    Returns:
+        List of dicts with 'speech_text', 'emotion' and 'background' keys.
+    """
+    get_access_token = access_token if callable(access_token) else lambda: access_token
+    chunks = plan_narration(text, chunk_tokens)
+
+    if len(chunks) <= 1:
+        return _narrate_chunk(text, tone, get_access_token, use_cache=use_cache,
+                              checkpoint=checkpoint, on_incomplete=on_incomplete)
+
+    print(f"Narrating {len(chunks)} chunks with up to {max_workers} workers")
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+        parts = list(pool.map(
+            lambda chunk: _narrate_chunk(chunk["text"], tone, get_access_token,
+                                         chunk["context"], use_cache, checkpoint,
+                                         on_incomplete=on_incomplete),
+            chunks,
+        ))
+
+    return stitch_narrations(parts)
+
+
+def stream_reader_json(text, tone, access_token, use_cache=True,
+                       max_workers=MAX_WORKERS, chunk_tokens=CHUNK_TOKENS,
+                       checkpoint=None, on_incomplete=None):
+    """
+    Streaming counterpart of genrate_reader_json.
+
+    Uses the WatsonX streaming endpoint and yields each emotion object as soon
+    as it is complete. Chunks are generated concurrently; objects are yielded
+    in document order, so later chunks are buffered until earlier ones finish.
+
+    Args:
+        Same as genrate_reader_json.
+
+    Yields:
+        Dicts with 'speech_text', 'emotion' and 'background' keys.
+    """
+    get_access_token = access_token if callable(access_token) else lambda: access_token
+    chunks = plan_narration(text, chunk_tokens)
+    if len(chunks) <= 1:
+        yield from _stream_chunk(text, tone, get_access_token, use_cache=use_cache,
+                                 checkpoint=checkpoint, on_incomplete=on_incomplete)
+        return
+
+    done = object()
+    queues = [queue.Queue() for _ in chunks]
+
+    def produce(chunk):
+        out = queues[chunk["index"]]
+        try:
+            for obj in _stream_chunk(chunk["text"], tone, get_access_token,
+                                     chunk["context"], use_cache, checkpoint,
+                                     on_incomplete=on_incomplete):
+                out.put(obj)
+            out.put(done)
+        except Exception as e:
+            out.put(e)
+
+    print(f"Streaming {len(chunks)} chunks with up to {max_workers} workers")
+    pool = ThreadPoolExecutor(max_workers=min(max_workers, len(chunks)))
+    try:
+        for chunk in chunks:
+            pool.submit(produce, chunk)
+
+        previous = []
+        for out in queues:
+            at_boundary = True
+            while True:
+                item = out.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if at_boundary and _is_overlap_repeat(item, previous):
+                    continue
+                at_boundary = False
+                previous = (previous + [item])[-3:]
+                yield item
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
 
 
 # print(
@@ -0,0 +1,161 @@
+import math
+import re
+from collections import Counter
+
+# Bump when the cleanup rules change so cached extractions are redone
+NORMALIZER_VERSION = "2"
+
+# Lines at the top and bottom of a page that may be running headers/footers
+EDGE_LINES = 3
+# Share of pages a line must repeat on to count as a running header/footer
+REPEAT_RATIO = 0.5
+
+# Words that mostly start hyphenated compounds ("well-known", "self-aware");
+# split after one of them at a line break, the hyphen is kept
+COMPOUND_HEADS = {
+    "all", "cross", "far", "full", "half", "high", "ill", "long", "low", "near",
+    "non", "old", "one", "part", "self", "short", "so", "two", "well", "worn",
+}
+
+_DIGITS_RE = re.compile(r"\d+")
+# Roman numerals only with a "page" prefix: bare, they are also words ("Mix", "I")
+_PAGE_NUMBER_RE = re.compile(
+    r"^(?:page\s*)?\d+(?:\s*(?:of|/)\s*\d+)?$|^page\s*[ivxlcdm]+$|^[-–—]\s*\d+\s*[-–—]$",
+    re.IGNORECASE,
+)
+_ARTIFACT_RE = re.compile(r"^[\W_]+$")
+_HYPHENATED_RE = re.compile(r"(\w+)[-‐]$")
+_LEADING_WORD_RE = re.compile(r"^\w+")
+_WORD_RE = re.compile(r"\w+(?:[-‐]\w+)*")
+_SPACES_RE = re.compile(r"[ \t ]+")
+_SENTENCE_END_RE = re.compile(r"[.!?:…][\"'”’)\]]*$")
+
+
+def _signature(line):
+    """Compare header/footer candidates ignoring case and changing numbers."""
+    return _DIGITS_RE.sub("#", line.lower()).strip()
+
+
+def _running_lines(pages):
+    """Signatures of lines repeated at page edges across most pages."""
+    if len(pages) < 2:
+        return set()
+    counts = Counter()
+    for lines in pages:
+        edges = lines[:EDGE_LINES] + lines[-EDGE_LINES:]
+        counts.update({_signature(line) for line in edges if line})
+    threshold = max(2, math.ceil(len(pages) * REPEAT_RATIO))
+    return {signature for signature, count in counts.items() if count >= threshold}
+
+
+def _join_hyphenated(head, tail, vocabulary):
+    """
+    Whether a word split as head-/tail over a line break is one word
+    ("configu-ration") rather than a compound ("well-known"). Without a
+    dictionary, the document's own vocabulary decides: the joined form used
+    elsewhere wins, then the hyphenated one. Otherwise a common compound
+    head, or a head and tail that are both words of their own, keep the
+    hyphen.
+    """
+    head, tail = head.lower(), tail.lower()
+    if head + tail in vocabulary:
+        return True
+    if f"{head}-{tail}" in vocabulary:
+        return False
+    return head not in COMPOUND_HEADS and not (head in vocabulary and tail in vocabulary)
+
+
+def _vocabulary(page_lines):
+    """Lowercase words of the text, leaving out the halves of line-break splits."""
+    vocabulary = set()
+    for lines in page_lines:
+        split = False
+        for line in lines:
+            words = _WORD_RE.findall(line.lower())
+            if split:
+                words = words[1:]
+            split = bool(_HYPHENATED_RE.search(line))
+            if split:
+                words = words[:-1]
+            vocabulary.update(word.replace("‐", "-") for word in words)
+    return vocabulary
+
+
+def normalize_pages(pages, page_edges=True):
+    """
+    Clean raw extracted page text before it is sent to the LLM.
+
+    Strips running headers/footers repeated across pages, standalone page
+    numbers and lines made only of punctuation, re-joins words hyphenated
+    across line breaks and collapses whitespace. Line breaks inside a
+    paragraph become spaces; blank lines become paragraph breaks, as do page
+    breaks unless a sentence runs over them.
+
+    Args:
+        pages: List of raw page texts, in order.
+        page_edges: Strip running headers/footers and page numbers. Off for
+            text that never had pages, such as typed input.
+
+    Returns:
+        (text, stats) where stats counts removed lines, repaired words and
+        characters saved.
+    """
+    stats = {
+        "input_chars": sum(len(page) for page in pages),
+        "running_lines_removed": 0,
+        "page_numbers_removed": 0,
+        "artifacts_removed": 0,
+        "hyphenations_repaired": 0,
+    }
+    page_lines = [[_SPACES_RE.sub(" ", line).strip() for line in page.splitlines()]
+                  for page in pages]
+    running = _running_lines(page_lines) if page_edges else set()
+    vocabulary = _vocabulary(page_lines)
+
+    # Kept lines of every page; None marks a page break
+    flow = []
+    for lines in page_lines:
+        count = len(lines)
+        for i, line in enumerate(lines):
+            at_edge = page_edges and (i < EDGE_LINES or i >= count - EDGE_LINES)
+            if not line:
+                flow.append("")
+            elif at_edge and _signature(line) in running:
+                stats["running_lines_removed"] += 1
+            elif at_edge and _PAGE_NUMBER_RE.match(line):
+                stats["page_numbers_removed"] += 1
+            elif _ARTIFACT_RE.match(line) and "..." not in line:
+                stats["artifacts_removed"] += 1
+            else:
+                flow.append(line)
+        flow.append(None)
+
+    paragraphs = []
+    paragraph = ""
+    for line in flow:
+        if line is None:
+            # A sentence running over the page break continues the paragraph
+            if paragraph and _SENTENCE_END_RE.search(paragraph):
+                paragraphs.append(paragraph)
+                paragraph = ""
+        elif not line:
+            if paragraph:
+                paragraphs.append(paragraph)
+            paragraph = ""
+        elif (head := _HYPHENATED_RE.search(paragraph)) and line[0].islower():
+            tail = _LEADING_WORD_RE.match(line)
+            if _join_hyphenated(head.group(1), tail.group() if tail else "", vocabulary):
+                paragraph = paragraph[:-1] + line
+                stats["hyphenations_repaired"] += 1
+            else:
+                # A compound broken at its own hyphen keeps it
+                paragraph += line
+        else:
+            paragraph = f"{paragraph} {line}" if paragraph else line
+    if paragraph:
+        paragraphs.append(paragraph)
+
+    text = "\n\n".join(paragraphs)
+    stats["output_chars"] = len(text)
+    stats["saved_chars"] = stats["input_chars"] - stats["output_chars"]
+    return text, stats
@@ -0,0 +1,308 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+from cache import CACHE_ROOT, DiskCache, make_key, normalize_text
+from extract import iter_text
+from normalize import NORMALIZER_VERSION, normalize_pages
+import token_budget
+from model import (PROMPT_VERSION, body, build_request_body, genrate_reader_json,
+                   plan_narration, stream_reader_json)
+from tts import (MAX_BATCH_CHARS, OUTPUT_FORMAT, render_batches, resolve_voice,
+                 synthesize_batches)
+
+# Stages in dependency order; each one's output is memoized on its inputs
+EXTRACT = "extract"
+NARRATE = "narrate"
+RENDER = "render"
+SYNTHESIZE = "synthesize"
+STAGES = (EXTRACT, NARRATE, RENDER, SYNTHESIZE)
+
+MEMO_ENTRIES = int(os.getenv("ECHOVERSE_PIPELINE_MEMO_ENTRIES", 128))
+
+# Extracted, normalized text of uploads, shared by all sessions and processes
+extraction_cache = DiskCache(
+    CACHE_ROOT / "extract",
+    max_bytes=int(os.getenv("ECHOVERSE_EXTRACT_CACHE_BYTES", 256 * 1024 * 1024)),
+)
+
+
+def fingerprint(data):
+    """Content hash identifying an uploaded file regardless of its name."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def stage_key(stage, *inputs):
+    """Hash a stage name and its inputs into a memo key."""
+    return make_key(stage, *(
+        value if isinstance(value, (str, bytes)) else json.dumps(value, sort_keys=True)
+        for value in inputs
+    ))
+
+
+def narration_key(text, tone):
+    return stage_key(NARRATE, normalize_text(text), tone, body["model_id"], PROMPT_VERSION)
+
+
+def render_key(text, tone, voice_name, max_batch_chars=MAX_BATCH_CHARS):
+    return stage_key(RENDER, narration_key(text, tone), resolve_voice(voice_name), max_batch_chars)
+
+
+def output_key(text, tone, voice_name, audio_format=OUTPUT_FORMAT):
+    """Key of the final audio; equal keys always produce the same audiobook."""
+    return stage_key(SYNTHESIZE, render_key(text, tone, voice_name), audio_format.accept)
+
+
+def estimate(text, tone, streaming=True, max_workers=None):
+    """
+    Estimate a conversion before it is submitted, see token_budget.estimate.
+
+    Args:
+        text: Extracted source text.
+        tone: Narration tone.
+        streaming: Whether the conversion will use the streaming endpoint.
+        max_workers: Concurrent requests per stage, as passed to Pipeline.run.
+
+    Returns:
+        Dict with 'watsonx_tokens', 'tts_chars', 'seconds' and their parts.
+    """
+    chunks = plan_narration(text)
+    prompt_chars = sum(len(build_request_body(chunk["text"], tone, chunk["context"])["input"])
+                       for chunk in chunks)
+    return token_budget.estimate(
+        [chunk["text"] for chunk in chunks], prompt_chars, streaming=streaming,
+        narration_workers=max_workers, tts_workers=max_workers,
+        max_batch_chars=MAX_BATCH_CHARS)
+
+
+class Pipeline:
+    """
+    extract -> narrate -> render SSML -> synthesize, with every stage's output
+    memoized in memory against its inputs.
+
+    A voice change therefore only re-renders and re-synthesizes, a tone change
+    re-narrates and re-synthesizes, and an unchanged request reuses every
+    stage. Synthesis itself is memoized per batch by the audio cache in tts.
+
+    Args:
+        max_entries: Number of stage results kept in memory.
+    """
+
+    def __init__(self, max_entries=MEMO_ENTRIES):
+        self.max_entries = max_entries
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return self._memo[key]
+            return None
+
+    def _put(self, key, value):
+        with self._lock:
+            self._memo[key] = value
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+
+    def extract(self, data, mime_type, pages=None, on_page=None, source_fingerprint=None):
+        """
+        Extract plain text from uploaded file bytes and normalize it, see
+        normalize.normalize_pages.
+
+        Results are cached on disk under the upload's content fingerprint,
+        so a file any session has uploaded before is not parsed again.
+
+        Pages arrive in order as they are extracted, but are collected before
+        anything goes downstream: normalization compares every page to find
+        running headers and uses the whole text's vocabulary to repair
+        hyphenation, and jobs are keyed and budget-checked on the full text.
+
+        Args:
+            data: File contents.
+            mime_type: "application/pdf" or "text/plain".
+            pages: Optional PDF page selection, e.g. "1-10, 15".
+            on_page: Optional callback(page_number) as each page is extracted.
+            source_fingerprint: fingerprint(data), if the caller already has it.
+
+        Returns:
+            (text, normalization stats).
+
+        Raises:
+            ValueError: If the file type or page selection is not supported.
+        """
+        source_fingerprint = source_fingerprint or fingerprint(data)
+        key = stage_key(EXTRACT, source_fingerprint, mime_type, pages or "", NORMALIZER_VERSION)
+        result = self._get(key)
+        if result is not None:
+            return result
+
+        cached = extraction_cache.get(key)
+        if cached is not None:
+            result = tuple(json.loads(cached))
+            self._put(key, result)
+            return result
+
+        page_texts = []
+        with metrics.span("extract", mime_type=mime_type, bytes=len(data)) as span:
+            for page_number, page_text in iter_text(data, mime_type, pages):
+                page_texts.append(page_text)
+                if on_page:
+                    on_page(page_number)
+            span.set(pages=len(page_texts), chars=sum(map(len, page_texts)))
+        with metrics.span("normalize") as span:
+            result = normalize_pages(page_texts)
+            span.set(input_chars=result[1]["input_chars"],
+                     output_chars=result[1]["output_chars"])
+
+        extraction_cache.set(key, json.dumps(result).encode("utf-8"))
+        self._put(key, result)
+        return result
+
+    def narrate(self, text, tone, access_token, streaming=True, max_workers=None,
+                checkpoint=None):
+        """
+        Yield the narration for text, from memory when it was produced before.
+        A fresh narration is memoized once it has been fully generated, unless
+        a chunk of it stayed incomplete: like the narration cache, the memo
+        then leaves it to be requested again.
+        """
+        key = narration_key(text, tone)
+        narration = self._get(key)
+        if narration is not None:
+            yield from narration
+            return
+
+        options = {"max_workers": max_workers} if max_workers else {}
+        options["checkpoint"] = checkpoint
+        incomplete = threading.Event()
+        options["on_incomplete"] = incomplete.set
+        if streaming:
+            stream = stream_reader_json(text, tone, access_token, **options)
+        else:
+            stream = genrate_reader_json(text, tone, access_token, **options)
+        narration = []
+        for obj in stream:
+            narration.append(obj)
+            yield obj
+        if not incomplete.is_set():
+            self._put(key, narration)
+
+    def render(self, narration, text, tone, voice_name):
+        """
+        Yield SSML batches for a narration, memoized per narration and voice.
+        Batches are only memoized when the narration itself was, so batches of
+        an incomplete narration are not reused either.
+        """
+        key = render_key(text, tone, voice_name)
+        batches = self._get(key)
+        if batches is not None:
+            yield from batches
+            return
+
+        batches = []
+        for batch in render_batches(narration, voice_name, MAX_BATCH_CHARS):
+            batches.append(batch)
+            yield batch
+        if self._get(narration_key(text, tone)) is not None:
+            self._put(key, batches)
+        token_budget.record_rendering(
+            len(text), sum(len(synthesis_text) for synthesis_text, _ in batches))
+
+    def run(self, text, tone, voice_name, tts_api_key, output_file,
+            access_token, streaming=True, on_narration=None,
+            on_narration_done=None, on_batch=None, max_workers=None,
+            checkpoint=None, audio_format=OUTPUT_FORMAT, parts_dir=None):
+        """
+        Run the narrate, render and synthesize stages for one request.
+
+        Stages are chained lazily so that, with streaming, synthesis of the
+        first batches overlaps with narration of the rest.
+
+        Args:
+            text: Extracted source text.
+            tone: Narration tone.
+            voice_name: Voice name from tts.ENGLISH_VOICES.
+            tts_api_key: TTS API key; when missing only narration runs.
+            output_file: Where to write the final audio.
+            access_token: Bearer string or callable, see genrate_reader_json.
+            streaming: Use the WatsonX streaming endpoint.
+            on_narration: Optional callback(obj) for every narration object.
+            on_narration_done: Optional callback() once narration is complete.
+            on_batch: Optional callback(index, path), see generate_tts.
+            max_workers: Concurrent requests per stage; None uses the
+                WatsonX and TTS defaults.
+            checkpoint: Optional checkpoints.CheckpointStore recording
+                finished chunks and batches so an interrupted run resumes.
+            audio_format: audio.AudioFormat of output_file.
+            parts_dir: Optional directory to keep the per-batch audio
+                files in, see generate_tts.
+
+        Returns:
+            The complete narration as a list of emotion objects.
+        """
+        try:
+            with metrics.span("pipeline.run", chars=len(text), tone=tone,
+                              voice=voice_name) as span:
+                narration = self._run(text, tone, voice_name, tts_api_key, output_file,
+                                      access_token, streaming, on_narration,
+                                      on_narration_done, on_batch, max_workers, checkpoint,
+                                      audio_format, parts_dir)
+                span.set(objects=len(narration))
+        finally:
+            # The conversion's measurements, in one write
+            token_budget.get_calibration().flush()
+        return narration
+
+    def _run(self, text, tone, voice_name, tts_api_key, output_file, access_token,
+             streaming, on_narration, on_narration_done, on_batch, max_workers,
+             checkpoint, audio_format, parts_dir):
+        narration = []
+
+        def recorded(objects):
+            for obj in objects:
+                narration.append(obj)
+                if on_narration:
+                    on_narration(obj)
+                yield obj
+            if on_narration_done:
+                on_narration_done()
+
+        if not tts_api_key:
+            for _ in recorded(self.narrate(text, tone, access_token, streaming, max_workers, checkpoint)):
+                pass
+            return narration
+
+        batches = self._get(render_key(text, tone, voice_name))
+        if batches is not None:
+            # Rendered before: the batches already carry the narration
+            for _ in recorded(obj for _, objects in batches for obj in objects):
+                pass
+        else:
+            batches = self.render(
+                recorded(self.narrate(text, tone, access_token, streaming, max_workers, checkpoint)),
+                text, tone, voice_name)
+
+        options = {"max_workers": max_workers} if max_workers else {}
+        synthesize_batches(batches, output_file, voice_name, tts_api_key,
+                           on_batch=on_batch, checkpoint=checkpoint,
+                           audio_format=audio_format, parts_dir=parts_dir, **options)
+        return narration
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    """Return the process-wide pipeline."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = Pipeline()
+        return _pipeline
@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# Responses that mean the service wants fewer requests from us
+THROTTLE_STATUSES = {429, 503}
+# How often callers that cannot block on the condition re-check a full limiter
+POLL_SECONDS = 0.05
+
+
+def _config(service, name, default):
+    return float(os.getenv(f"ECHOVERSE_{service.upper()}_{name}", default))
+
+
+class AdaptiveLimiter:
+    """
+    Request budget for one remote service, shared by every thread calling it.
+
+    Two limits apply to each request:
+
+    - A token bucket caps the request rate at `rate` per second with bursts
+      of up to `burst` requests.
+    - An adaptive concurrency limit (AIMD) caps the requests in flight. Every
+      successful call raises it additively, by one per `limit` successes, up
+      to `max_concurrency`; a 429 or 503 halves it, down to
+      `min_concurrency`. A Retry-After on such a response also pauses new
+      requests to the service until it has passed.
+
+    The limiter therefore settles at the highest concurrency the account
+    sustains instead of relying on a guessed worker count.
+
+    Args:
+        name: Service name, used in logs and stats.
+        rate: Requests per second allowed on average.
+        burst: Bucket size, i.e. requests that may start back to back.
+        max_concurrency: Upper bound of the adaptive concurrency limit.
+        min_concurrency: Lower bound of the adaptive concurrency limit.
+        initial_concurrency: Limit to start from; defaults to max_concurrency / 4.
+    """
+
+    def __init__(self, name, rate, burst, max_concurrency, min_concurrency=1,
+                 initial_concurrency=None):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        if initial_concurrency is None:
+            initial_concurrency = max(min_concurrency, max_concurrency / 4)
+        self.limit = float(initial_concurrency)
+        self.in_flight = 0
+        self.throttled = 0
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def try_acquire(self):
+        """
+        Take a slot and a token if both are available.
+
+        Returns:
+            0 when the request may start, otherwise the seconds to wait
+            before trying again.
+        """
+        with self._condition:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self.in_flight >= int(self.limit):
+                return POLL_SECONDS
+            self._refill(now)
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+            self.in_flight += 1
+            return 0
+
+    def acquire(self):
+        """Block until the request may start."""
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return
+            with self._condition:
+                # Woken early when a slot is released
+                self._condition.wait(delay)
+
+    def release(self, status=None, retry_after=None):
+        """
+        Return the slot of a finished request and adapt the limit.
+
+        Args:
+            status: HTTP status of the response, or None if the request
+                failed without one.
+            retry_after: Seconds from a Retry-After header, if any.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if status in THROTTLE_STATUSES:
+                self.throttled += 1
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                if retry_after:
+                    self._paused_until = max(self._paused_until,
+                                             time.monotonic() + retry_after)
+                print(f"🐢 {self.name} throttled ({status}), "
+                      f"concurrency limit now {int(self.limit)}")
+            elif status is not None and status < 400:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def stats(self):
+        """Current limits and load, for monitoring."""
+        with self._condition:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "tokens": round(self._tokens, 2),
+                "concurrency_limit": int(self.limit),
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "throttled": self.throttled,
+                "paused_for": round(max(0.0, self._paused_until - now), 2),
+            }
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header value, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        # HTTP-date form
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+# Per-service defaults: (requests per second, burst, max concurrency)
+DEFAULTS = {
+    "iam": (5, 5, 4),
+    "watsonx": (8, 8, 16),
+    "tts": (10, 10, 16),
+}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(service):
+    """
+    Return the process-wide limiter of a service ('iam', 'watsonx' or 'tts').
+    Each default can be overridden with ECHOVERSE_<SERVICE>_RATE, _BURST and
+    _MAX_CONCURRENCY.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(service)
+        if limiter is None:
+            rate, burst, max_concurrency = DEFAULTS.get(service, (10, 10, 16))
+            limiter = AdaptiveLimiter(
+                service,
+                rate=_config(service, "RATE", rate),
+                burst=_config(service, "BURST", burst),
+                max_concurrency=int(_config(service, "MAX_CONCURRENCY", max_concurrency)),
+            )
+            _limiters[service] = limiter
+        return limiter
+
+
+def limits():
+    """Stats of every limiter in use, keyed by service."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
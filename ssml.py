@@ -0,0 +1,228 @@
+import re
+import time
+from xml.sax.saxutils import escape
+
+import metrics
+
+# How each narration emotion is voiced: the express-as type and the prosody
+# attributes that differ from the voice's defaults. Emotions mapped to None,
+# and unknown ones, are read without any wrapper.
+STYLES = {
+    "ANGRY": ("angry", {"rate": "fast", "pitch": "+20%"}),
+    "SAD": ("sad", {"rate": "slow", "pitch": "-15%"}),
+    "HAPPY": ("cheerful", {"pitch": "+10%"}),
+    "FEAR": ("afraid", {"rate": "fast", "pitch": "+25%"}),
+    "SURPRISE": ("surprised", {"rate": "fast", "pitch": "+20%"}),
+    "DISGUST": ("disgusted", {"rate": "slow", "pitch": "-10%"}),
+    "EXCITED": ("excited", {}),
+    "CALM": ("calm", {}),
+    "NEUTRAL": None,
+}
+# Other spellings the model produces, including the prompt's own 'SUPRISE'
+ALIASES = {"JOY": "HAPPY", "SUPRISE": "SURPRISE", "SURPRISED": "SURPRISE"}
+
+# Pause inserted where the emotion changes
+PAUSE = '<break time="0.8s"/>'
+# Pause between the segments of a plain document, which has no emotion
+# changes to mark where one segment ends
+SEGMENT_PAUSE = '<break time="0.4s"/>'
+SPEAK_OPEN = "<speak>"
+SPEAK_CLOSE = "</speak>"
+
+# Characters XML 1.0 does not allow at all
+_INVALID_XML_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+_EXPRESSION_TAG_RE = re.compile(r"</?(?:express-as|prosody)\b[^>]*>")
+_SENTENCE_END_RE = re.compile(r"[.!?…:;][\"'”’)\]]*$")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+def style_of(emotion):
+    """The STYLES entry for an emotion, or None for a plain reading."""
+    emotion = (emotion or "").strip().upper()
+    return STYLES.get(ALIASES.get(emotion, emotion))
+
+
+def escape_text(text):
+    """Escape text for use as SSML character data."""
+    return escape(_INVALID_XML_RE.sub("", text))
+
+
+def _sentence(text):
+    """Text ending in punctuation, so joined segments keep their pauses."""
+    text = " ".join(text.split())
+    return text if _SENTENCE_END_RE.search(text) else f"{text}."
+
+
+def open_tags(style):
+    if style is None:
+        return ""
+    express_as, prosody = style
+    tags = f'<express-as type="{express_as}">'
+    if prosody:
+        attributes = " ".join(f'{name}="{value}"' for name, value in prosody.items())
+        tags += f"<prosody {attributes}>"
+    return tags
+
+
+def close_tags(style):
+    if style is None:
+        return ""
+    return ("</prosody>" if style[1] else "") + "</express-as>"
+
+
+def strip_expression(document):
+    """
+    Remove express-as and prosody elements, keeping text and pauses, for
+    voices that do not support them.
+    """
+    return _EXPRESSION_TAG_RE.sub("", document)
+
+
+def _size(text):
+    return len(text.encode("utf-8"))
+
+
+class Document:
+    """
+    One <speak> document built segment by segment, with its exact size in
+    UTF-8 bytes known before every addition.
+
+    Consecutive segments in the same style share one express-as/prosody
+    element; a pause separates different styles. Without styles, a shorter
+    pause separates every segment.
+
+    Args:
+        expressive: Apply emotion styles; otherwise every segment is plain.
+    """
+
+    def __init__(self, expressive=True):
+        self.expressive = expressive
+        self.objects = []
+        self._body = []
+        self._style = None
+        self._empty = True
+        self.size = _size(SPEAK_OPEN + SPEAK_CLOSE)
+        # Joins segments that share a style
+        self._separator = " " if expressive else SEGMENT_PAUSE
+
+    def _style_of(self, emotion):
+        return style_of(emotion) if self.expressive else None
+
+    def cost(self, text, emotion=None):
+        """Bytes that add(text, emotion) would add to the document."""
+        style = self._style_of(emotion)
+        if self._empty:
+            return _size(open_tags(style) + text + close_tags(style))
+        if style == self._style:
+            return _size(self._separator + text)
+        return _size(PAUSE + open_tags(style) + text + close_tags(style))
+
+    def add(self, text, emotion=None, obj=None):
+        """
+        Append escaped text. obj, if given, is the narration object the text
+        belongs to.
+        """
+        style = self._style_of(emotion)
+        self.size += self.cost(text, emotion)
+        if self._empty:
+            self._body.append(open_tags(style) + text)
+        elif style == self._style:
+            self._body.append(self._separator + text)
+        else:
+            # The previous close tags were already counted in size
+            self._body.append(close_tags(self._style) + PAUSE + open_tags(style) + text)
+        self._style = style
+        self._empty = False
+        if obj is not None:
+            self.objects.append(obj)
+
+    @property
+    def empty(self):
+        return self._empty
+
+    def render(self):
+        return SPEAK_OPEN + "".join(self._body) + close_tags(self._style) + SPEAK_CLOSE
+
+
+def _split_to_fit(text, limit):
+    """
+    Split raw text into pieces whose escaped size is at most limit bytes, at
+    sentence boundaries where possible, then at words, then anywhere.
+    """
+    def fits(piece):
+        return _size(escape_text(piece)) <= limit
+
+    pieces, current = [], ""
+    for unit in _SENTENCE_RE.split(text):
+        for word in ([unit] if fits(unit) else unit.split(" ")):
+            candidate = f"{current} {word}" if current else word
+            if fits(candidate):
+                current = candidate
+                continue
+            if current:
+                pieces.append(current)
+            current = ""
+            # Only a word longer than limit gets here without fitting
+            for char in word:
+                if current and not fits(current + char):
+                    pieces.append(current)
+                    current = ""
+                current += char
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def iter_documents(emotion_objects, expressive, max_bytes, is_boundary=None):
+    """
+    Render emotion objects into SSML documents of at most max_bytes each.
+
+    Text is escaped and segments are merged per style, so markup costs as
+    little of the request size and billed characters as possible. A
+    segment too large for any document is split across several; only the
+    first of them lists its object. emotion_objects may be any iterable;
+    each document is yielded as soon as it is closed.
+
+    Args:
+        emotion_objects: Dicts with 'speech_text' and optional 'emotion'.
+        expressive: Whether the voice supports express-as and prosody.
+        max_bytes: Size limit of one document in UTF-8 bytes.
+        is_boundary: Optional predicate(obj); a document also ends after
+            every object it is true for.
+
+    Yields:
+        (ssml, objects) tuples in document order.
+    """
+    document = Document(expressive)
+    # Time spent rendering the open document, excluding waits for new objects
+    render_seconds = 0.0
+
+    def close():
+        started = time.perf_counter()
+        ssml = document.render()
+        metrics.observe("ssml.render", render_seconds + time.perf_counter() - started,
+                        objects=len(document.objects), chars=len(ssml))
+        return ssml, document.objects
+
+    for obj in emotion_objects:
+        started = time.perf_counter()
+        emotion = obj.get("emotion")
+        sentence = _sentence(obj["speech_text"])
+        pieces = [escape_text(sentence)]
+        fresh = Document(expressive)
+        if fresh.size + fresh.cost(pieces[0], emotion) > max_bytes:
+            limit = max_bytes - fresh.size - fresh.cost("", emotion)
+            pieces = [escape_text(piece) for piece in _split_to_fit(sentence, limit)]
+        render_seconds += time.perf_counter() - started
+
+        for index, piece in enumerate(pieces):
+            if not document.empty and document.size + document.cost(piece, emotion) > max_bytes:
+                yield close()
+                document, render_seconds = Document(expressive), 0.0
+            document.add(piece, emotion, obj if index == 0 else None)
+
+        if is_boundary is not None and is_boundary(obj):
+            yield close()
+            document, render_seconds = Document(expressive), 0.0
+    if not document.empty:
+        yield close()
@@ -0,0 +1,163 @@
+import json
+import re
+
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+# Field values in double or single quotes, for objects json cannot decode
+_FIELD_RE = r"""["']{name}["']\s*:\s*(?:"((?:[^"\\]|\\.)*?)"|'((?:[^'\\]|\\.)*?)')\s*(?=[,}}]|$)"""
+_FIELDS = ("speech_text", "emotion", "background")
+
+
+def _escape_inner_quotes(raw):
+    """
+    Escape double quotes inside string values that the model forgot to
+    escape. A quote only closes a string if a ',', ':', '}' or ']' follows.
+    """
+    out = []
+    in_string = escaped = False
+    for i, char in enumerate(raw):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                rest = raw[i + 1:].lstrip()
+                if rest and rest[0] not in ",:}]":
+                    out.append('\\"')
+                    continue
+                in_string = False
+        elif char == '"':
+            in_string = True
+        out.append(char)
+    return "".join(out)
+
+
+def _salvage_fields(raw):
+    """Pick the known fields out of an object that is not valid JSON."""
+    obj = {}
+    for name in _FIELDS:
+        match = re.search(_FIELD_RE.format(name=name), raw, re.DOTALL)
+        if match:
+            value = match.group(1) if match.group(1) is not None else match.group(2)
+            try:
+                obj[name] = json.loads(f'"{value}"', strict=False)
+            except ValueError:
+                obj[name] = value
+    return obj or None
+
+
+def repair_object(raw):
+    """
+    Best-effort decode of one object the model got slightly wrong: trailing
+    commas, raw control characters or unescaped quotes in strings, or
+    single-quoted fields.
+
+    Returns:
+        The decoded dict, or None if nothing could be salvaged.
+    """
+    candidate = _TRAILING_COMMA_RE.sub(r"\1", raw)
+    for attempt in (candidate, _escape_inner_quotes(candidate)):
+        try:
+            obj = json.loads(attempt, strict=False)
+        except ValueError:
+            continue
+        if isinstance(obj, dict):
+            return obj
+    return _salvage_fields(raw)
+
+
+def _normalize(obj):
+    """Check an emotion object's shape; None if it has nothing to read."""
+    speech_text = obj.get("speech_text")
+    if not isinstance(speech_text, str) or not speech_text.strip():
+        return None
+    obj["speech_text"] = speech_text.strip()
+    for name in ("emotion", "background"):
+        value = obj.get(name)
+        obj[name] = value.strip().upper() if isinstance(value, str) else ""
+    return obj
+
+
+class EmotionObjectParser:
+    """
+    Incrementally extract JSON objects from a streamed JSON array.
+
+    Text is fed in arbitrary pieces as it arrives from the model; every
+    top-level object is decoded and returned as soon as its closing brace
+    is seen. Brackets and braces inside strings are ignored, and anything
+    after the array's closing bracket is ignored.
+
+    The parser is tolerant: objects json cannot decode are passed through
+    repair_object, and objects that still cannot be read are recorded in
+    `dropped` instead of failing the whole response. `complete` tells
+    whether the array was closed, i.e. whether the output was cut off.
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._opened = False
+        self.complete = False
+        self.repaired = 0
+        self.dropped = []
+
+    def feed(self, text):
+        """Consume more text and return the objects completed by it."""
+        completed = []
+        for char in text:
+            if self.complete:
+                break
+            if self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                    self._buffer = [char]
+                elif char == "[":
+                    self._opened = True
+                elif char == "]" and self._opened:
+                    self.complete = True
+                continue
+
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    obj = self._decode("".join(self._buffer))
+                    if obj is not None:
+                        completed.append(obj)
+                    self._buffer = []
+        return completed
+
+    def _decode(self, raw):
+        try:
+            obj = json.loads(raw)
+        except ValueError:
+            obj = repair_object(raw)
+            if obj is not None:
+                self.repaired += 1
+        obj = _normalize(obj) if isinstance(obj, dict) else None
+        if obj is None:
+            self.dropped.append(raw)
+        return obj
+
+    @property
+    def pending(self):
+        """Text of an object that has started but not yet closed."""
+        return "".join(self._buffer) if self._depth else ""
+
+    @property
+    def defective(self):
+        """True if the output was cut off or an object had to be dropped."""
+        return not self.complete or bool(self.dropped)
@@ -0,0 +1,304 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+
+import metrics
+from cache import CACHE_ROOT
+from chunker import CHARS_PER_TOKEN
+from rate_limit import get_limiter
+
+# Measured ratios, updated after every request, so estimates follow the
+# model, voices and documents actually in use
+CALIBRATION_FILE = Path(os.getenv("ECHOVERSE_CALIBRATION_FILE",
+                                  CACHE_ROOT / "calibration.json"))
+# Weight of the newest measurement in a ratio's moving average
+ALPHA = 0.2
+# Seconds between writes of the calibration file; Calibration.flush writes
+# the rest, at the end of every conversion and at exit
+SAVE_INTERVAL = 10.0
+
+# The model's generation limit, and how much room max_new_tokens leaves
+# above the expected output length
+MAX_NEW_TOKENS = int(os.getenv("ECHOVERSE_MAX_NEW_TOKENS", 8192))
+OUTPUT_HEADROOM = float(os.getenv("ECHOVERSE_OUTPUT_HEADROOM", 1.5))
+MIN_NEW_TOKENS = 256
+
+# Job caps checked before a conversion starts; unset means unlimited
+MAX_JOB_TOKENS = os.getenv("ECHOVERSE_MAX_JOB_TOKENS")
+MAX_JOB_SECONDS = os.getenv("ECHOVERSE_MAX_JOB_SECONDS")
+
+# Starting points until measurements come in
+DEFAULT_RATIOS = {
+    # Prompt characters per WatsonX input token
+    "chars_per_token": CHARS_PER_TOKEN,
+    # Generated tokens per token of narrated text; the JSON keys roughly
+    # double the length of the text itself
+    "output_ratio": 2.0,
+    # Characters sent to Text to Speech (SSML included) per source character
+    "tts_chars_ratio": 1.1,
+    "seconds_per_output_token": 0.03,
+    "seconds_per_tts_char": 0.002,
+}
+
+# WatsonX stop reasons of a generation cut off by its token budget
+TRUNCATED = ("max_tokens", "token_limit")
+
+
+class BudgetExceeded(ValueError):
+    """A job's estimated tokens or duration exceed the configured cap."""
+
+
+class Calibration:
+    """
+    Exponential moving averages of the ratios the estimates are built on,
+    persisted as JSON so they carry over between runs and processes.
+    Updates are written at most every save_interval seconds, and by flush.
+
+    Args:
+        path: JSON file holding the ratios.
+        alpha: Weight of each new measurement.
+        save_interval: Minimum seconds between writes of the file.
+    """
+
+    def __init__(self, path=CALIBRATION_FILE, alpha=ALPHA, save_interval=SAVE_INTERVAL):
+        self.path = Path(path)
+        self.alpha = alpha
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._ratios = None  # name -> {"value", "samples"}
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def _load(self):
+        if self._ratios is not None:
+            return
+        self._ratios = {}
+        try:
+            self._ratios = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            pass
+
+    def get(self, name):
+        with self._lock:
+            self._load()
+            entry = self._ratios.get(name)
+            return entry["value"] if entry else DEFAULT_RATIOS[name]
+
+    def update(self, name, observed):
+        """Fold one measurement into a ratio and persist the result."""
+        if observed <= 0 or not math.isfinite(observed):
+            return
+        with self._lock:
+            self._load()
+            entry = self._ratios.get(name) or {"value": DEFAULT_RATIOS[name], "samples": 0}
+            entry["value"] += self.alpha * (observed - entry["value"])
+            entry["samples"] += 1
+            self._ratios[name] = entry
+            self._dirty = True
+            if time.monotonic() - self._saved_at >= self.save_interval:
+                self._save()
+
+    def flush(self):
+        """Write pending updates to the file."""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def _save(self):
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(
+                f"{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_text(json.dumps(self._ratios, indent=2), encoding="utf-8")
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️ Could not save calibration: {e}")
+
+    def ratios(self):
+        """Every ratio with its current value and number of measurements."""
+        with self._lock:
+            self._load()
+            return {name: dict(self._ratios.get(name) or {"value": default, "samples": 0})
+                    for name, default in DEFAULT_RATIOS.items()}
+
+    def reset(self):
+        with self._lock:
+            self._ratios = {}
+            self._dirty = False
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+
+_calibration = None
+_calibration_lock = threading.Lock()
+
+
+def get_calibration():
+    """Return the process-wide calibration."""
+    global _calibration
+    with _calibration_lock:
+        if _calibration is None:
+            _calibration = Calibration()
+            atexit.register(_calibration.flush)
+        return _calibration
+
+
+def text_tokens(text):
+    """Calibrated estimate of the tokens in text."""
+    return math.ceil(len(text) / get_calibration().get("chars_per_token"))
+
+
+def expected_output_tokens(text):
+    """Tokens the model is expected to generate when narrating text."""
+    return math.ceil(text_tokens(text) * get_calibration().get("output_ratio"))
+
+
+def max_new_tokens(text):
+    """
+    Generation budget for narrating text: the expected output plus headroom,
+    within the model's limit. Short inputs no longer reserve the full limit.
+    """
+    budget = math.ceil(expected_output_tokens(text) * OUTPUT_HEADROOM) + MIN_NEW_TOKENS
+    return min(MAX_NEW_TOKENS, budget)
+
+
+def max_chunk_tokens():
+    """
+    Largest chunk, in chunker.estimate_tokens units, whose narration is
+    expected to fit max_new_tokens with headroom, so long inputs are split
+    instead of being cut off.
+
+    Worked out from DEFAULT_RATIOS, not the calibration: chunk boundaries
+    are part of the narration cache and checkpoint keys, so they must not
+    move as the measured ratios do. The calibration only sizes
+    max_new_tokens.
+    """
+    output_tokens = (MAX_NEW_TOKENS - MIN_NEW_TOKENS) / OUTPUT_HEADROOM
+    chars = (output_tokens / DEFAULT_RATIOS["output_ratio"]
+             * DEFAULT_RATIOS["chars_per_token"])
+    return max(1, int(chars / CHARS_PER_TOKEN))
+
+
+def record_generation(text, prompt, generation, seconds):
+    """
+    Calibrate the WatsonX ratios from one finished request and record the
+    estimated against the actual output tokens.
+
+    Args:
+        text: Text that was narrated.
+        prompt: Complete prompt that was sent.
+        generation: Last 'results' entry of the response, with token counts
+            and the stop reason.
+        seconds: Wall-clock duration of the request.
+    """
+    calibration = get_calibration()
+    expected = expected_output_tokens(text)
+    input_tokens = generation.get("input_token_count") or 0
+    generated = generation.get("generated_token_count") or 0
+    metrics.count("generated_tokens", expected, source="estimated")
+    metrics.count("generated_tokens", generated, source="actual")
+
+    if input_tokens:
+        calibration.update("chars_per_token", len(prompt) / input_tokens)
+    if not generated:
+        return
+    if generation.get("stop_reason") in TRUNCATED:
+        # The true length is unknown but larger: grow the ratio
+        metrics.count("generation_truncated")
+        calibration.update("output_ratio", calibration.get("output_ratio") * OUTPUT_HEADROOM)
+    else:
+        calibration.update("output_ratio", generated / text_tokens(text))
+    calibration.update("seconds_per_output_token", seconds / generated)
+
+
+def record_rendering(source_chars, tts_chars):
+    """Calibrate how many TTS characters a source character turns into."""
+    if source_chars:
+        get_calibration().update("tts_chars_ratio", tts_chars / source_chars)
+
+
+def record_synthesis(chars, seconds):
+    """Calibrate synthesis speed from one TTS request."""
+    metrics.count("tts_chars", chars)
+    if chars:
+        get_calibration().update("seconds_per_tts_char", seconds / chars)
+
+
+def estimate(chunks, prompt_chars, streaming=True, narration_workers=None,
+             tts_workers=None, max_batch_chars=4800):
+    """
+    Pre-flight estimate of a conversion's WatsonX tokens, TTS characters and
+    wall-clock time from the calibrated ratios.
+
+    Requests run in waves of as many as the services' concurrency limits
+    allow. With streaming, synthesis overlaps narration, so only the last
+    wave of synthesis adds to the narration time.
+
+    Args:
+        chunks: Texts of the chunks that will be narrated.
+        prompt_chars: Total characters of the prompts for those chunks.
+        streaming: Whether synthesis starts while narration runs.
+        narration_workers: Cap on concurrent WatsonX requests, if any.
+        tts_workers: Cap on concurrent TTS requests, if any.
+        max_batch_chars: Characters per TTS request.
+
+    Returns:
+        Dict with token, character, request and second counts.
+    """
+    calibration = get_calibration()
+    source_chars = sum(map(len, chunks))
+    input_tokens = math.ceil(prompt_chars / calibration.get("chars_per_token"))
+    output_tokens = [expected_output_tokens(chunk) for chunk in chunks]
+    tts_chars = math.ceil(source_chars * calibration.get("tts_chars_ratio"))
+    tts_batches = math.ceil(tts_chars / max_batch_chars)
+
+    def waves(requests, service, workers):
+        concurrency = get_limiter(service).stats()["concurrency_limit"]
+        return math.ceil(requests / max(1, min(concurrency, workers or concurrency)))
+
+    seconds_per_token = calibration.get("seconds_per_output_token")
+    narration_seconds = (waves(len(chunks), "watsonx", narration_workers)
+                         * max(output_tokens, default=0) * seconds_per_token)
+    batch_seconds = min(tts_chars, max_batch_chars) * calibration.get("seconds_per_tts_char")
+    synthesis_seconds = waves(tts_batches, "tts", tts_workers) * batch_seconds
+    if streaming:
+        seconds = max(narration_seconds + batch_seconds, synthesis_seconds)
+    else:
+        seconds = narration_seconds + synthesis_seconds
+
+    return {
+        "chunks": len(chunks),
+        "input_tokens": input_tokens,
+        "output_tokens": sum(output_tokens),
+        "watsonx_tokens": input_tokens + sum(output_tokens),
+        "tts_chars": tts_chars,
+        "tts_batches": tts_batches,
+        "narration_seconds": round(narration_seconds, 1),
+        "synthesis_seconds": round(synthesis_seconds, 1),
+        "seconds": round(seconds, 1),
+    }
+
+
+def check_limits(job_estimate, max_tokens=None, max_seconds=None):
+    """
+    Raise BudgetExceeded if an estimate is over the token or time cap. The
+    caps default to ECHOVERSE_MAX_JOB_TOKENS and ECHOVERSE_MAX_JOB_SECONDS.
+    """
+    max_tokens = max_tokens or MAX_JOB_TOKENS
+    max_seconds = max_seconds or MAX_JOB_SECONDS
+    if max_tokens and job_estimate["watsonx_tokens"] > int(max_tokens):
+        raise BudgetExceeded(
+            f"Estimated {job_estimate['watsonx_tokens']:,} WatsonX tokens exceed "
+            f"the cap of {int(max_tokens):,}.")
+    if max_seconds and job_estimate["seconds"] > float(max_seconds):
+        raise BudgetExceeded(
+            f"Estimated {job_estimate['seconds']:,.0f}s exceed the cap of "
+            f"{float(max_seconds):,.0f}s.")
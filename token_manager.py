@@ -0,0 +1,127 @@
+import threading
+import time
+
+import metrics
+from get_token import request_iam_token
+
+# Refresh this many seconds before the token expires
+REFRESH_MARGIN = 300
+# Used when IAM omits both 'expiration' and 'expires_in'
+DEFAULT_LIFETIME = 3600
+
+
+class IAMTokenManager:
+    """
+    Caches an IAM access token for one API key and refreshes it shortly
+    before it expires.
+
+    Once a token enters the refresh margin it keeps being served while a
+    single background thread fetches a replacement. Only when no usable
+    token is left do callers block, and then concurrent callers share one
+    IAM request instead of each issuing their own.
+
+    Args:
+        api_key: IBM Cloud API key to exchange.
+        refresh_margin: Seconds before expiry at which to refresh.
+        timeout: Timeout for the IAM request in seconds.
+    """
+
+    def __init__(self, api_key, refresh_margin=REFRESH_MARGIN, timeout=15.0):
+        self.api_key = api_key
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+        self._access_token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _store(self, payload):
+        now = time.time()
+        if payload.get("expiration"):
+            expires_at = float(payload["expiration"])
+        elif payload.get("expires_in"):
+            expires_at = now + float(payload["expires_in"])
+        else:
+            expires_at = now + DEFAULT_LIFETIME
+        self._access_token = payload["access_token"]
+        self._expires_at = expires_at
+
+    def _refresh(self):
+        with metrics.span("iam.token"):
+            self._store(request_iam_token(self.api_key, timeout=self.timeout))
+
+    def _background_refresh(self):
+        try:
+            self._refresh()
+        except Exception as e:
+            # The current token is still valid; the next call will retry
+            print(f"Background IAM token refresh failed: {e}")
+        finally:
+            self._refreshing = False
+
+    def get_token(self):
+        """Return a valid raw access token, refreshing it if necessary."""
+        now = time.time()
+        token, expires_at = self._access_token, self._expires_at
+        if token and now < expires_at - self.refresh_margin:
+            return token
+
+        if token and now < expires_at:
+            # Still valid: serve it and refresh once in the background
+            with self._lock:
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(
+                        target=self._background_refresh, daemon=True).start()
+            return token
+
+        with self._lock:
+            # Another caller may have refreshed while we waited on the lock
+            if not self._access_token or time.time() >= self._expires_at:
+                self._refresh()
+            return self._access_token
+
+    def get_bearer(self):
+        """Return a 'Bearer <token>' string for Authorization headers."""
+        return f"Bearer {self.get_token()}"
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after the service rejected it."""
+        with self._lock:
+            self._access_token = None
+            self._expires_at = 0.0
+
+
+def invalidate_bearer(get_bearer):
+    """
+    Drop the token behind a bearer source after a service answered 401.
+
+    Args:
+        get_bearer: The callable a request took its bearer from.
+
+    Returns:
+        True if it is a token manager's get_bearer, so calling it again
+        fetches a new token; False for any other source, which would only
+        return the rejected token again.
+    """
+    manager = getattr(get_bearer, "__self__", None)
+    if not isinstance(manager, IAMTokenManager):
+        return False
+    manager.invalidate()
+    return True
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(api_key):
+    """Return the process-wide token manager for an API key."""
+    if not api_key:
+        raise ValueError("IBM Cloud API key must be provided.")
+    with _managers_lock:
+        manager = _managers.get(api_key)
+        if manager is None:
+            manager = IAMTokenManager(api_key)
+            _managers[api_key] = manager
+        return manager
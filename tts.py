@@ -1,10 +1,24 @@
 # tts_runner.py
+import contextlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from ibm_watson import TextToSpeechV1
-from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
+from ibm_cloud_sdk_core import ApiException
+from ibm_cloud_sdk_core.authenticators import Authenticator
+from token_manager import get_token_manager
+from audio import CHUNK_BYTES, AudioFormat
+from cache import CACHE_ROOT, DiskCache, make_key
+import http_client
+import metrics
+import ssml
+from token_budget import record_synthesis
 
 # --- IBM TTS setup ---
 # Removed global API_KEY and tts_service
-URL = "https://api.eu-de.text-to-speech.watson.cloud.ibm.com"
+URL = os.getenv("ECHOVERSE_TTS_URL", "https://api.eu-de.text-to-speech.watson.cloud.ibm.com")
 
 
 # English voice options
@@ -33,19 +47,43 @@ ENGLISH_VOICES = {
     "jack_australian": "en-AU_JackExpressive",
 }
 
-# Emotion mapping to SSML expressions
-EMOTION_MAPPING = {
-    'ANGRY': 'angry',
-    'DISGUST': 'disgusted',
-    'FEAR': 'afraid',
-    'HAPPY': 'cheerful',
-    'JOY': 'cheerful',
-    'SAD': 'sad',
-    'SURPRISE': 'surprised',
-    'NEUTRAL': 'neutral',
-    'EXCITED': 'excited',
-    'CALM': 'calm'
-}
+class ManagedIAMAuthenticator(Authenticator):
+    """Authenticator that takes bearer tokens from the shared token manager."""
+
+    def __init__(self, api_key):
+        self.token_manager = get_token_manager(api_key)
+
+    def authentication_type(self):
+        return Authenticator.AUTHTYPE_IAM
+
+    def validate(self):
+        pass
+
+    def authenticate(self, req):
+        req["headers"]["Authorization"] = self.token_manager.get_bearer()
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_tts_service(api_key):
+    """
+    Return a long-lived TTS client for an API key. It shares the pooled HTTP
+    session and the token manager with the rest of the app.
+    """
+    if not api_key:
+        raise ValueError("API Key is required for TTS generation.")
+    with _services_lock:
+        tts_service = _services.get(api_key)
+        if tts_service is None:
+            tts_service = TextToSpeechV1(authenticator=ManagedIAMAuthenticator(api_key))
+            tts_service.set_service_url(URL)
+            tts_service.set_http_client(http_client.get_session())
+            tts_service.set_http_config({
+                "timeout": (http_client.CONNECT_TIMEOUT, http_client.READ_TIMEOUT)})
+            _services[api_key] = tts_service
+        return tts_service
 
 
 def get_voice_info(voice_name):
@@ -62,119 +100,296 @@ def get_voice_info(voice_name):
     return info
 
 
+# The service accepts at most 5 KB of text per synthesize request
+MAX_BATCH_CHARS = 4800
+# Upper bound; the 'tts' rate limiter decides how many requests actually run
+MAX_WORKERS = int(os.getenv("ECHOVERSE_TTS_WORKERS", 16))
+FALLBACK_VOICE = "en-US_AllisonV3Voice"
+# Default output format, e.g. ECHOVERSE_AUDIO_FORMAT=ogg ECHOVERSE_AUDIO_RATE=24000
+OUTPUT_FORMAT = AudioFormat(os.getenv("ECHOVERSE_AUDIO_FORMAT", "mp3"),
+                            os.getenv("ECHOVERSE_AUDIO_RATE"))
+AUDIO_FORMAT = OUTPUT_FORMAT.accept
+# On average one in this many segments closes a batch early. Boundaries
+# depend only on the segment text, so editing one segment leaves the other
+# batches, and therefore their cached audio, unchanged.
+BATCH_BOUNDARY_EVERY = 8
+
+audio_cache = DiskCache(
+    CACHE_ROOT / "audio",
+    max_bytes=int(os.getenv("ECHOVERSE_AUDIO_CACHE_BYTES", 512 * 1024 * 1024)),
+)
+
+
+def _is_batch_boundary(obj):
+    key = make_key(obj["speech_text"], obj.get("emotion") or "")
+    return int(key[:8], 16) % BATCH_BOUNDARY_EVERY == 0
+
+
+def iter_batches(emotion_objects, is_expressive, max_chars=MAX_BATCH_CHARS):
+    """
+    Group emotion objects into SSML synthesis requests of at most max_chars
+    bytes, see ssml.iter_documents.
+
+    Besides the size limit, a batch also ends after any segment whose hash
+    marks it as a boundary, which keeps batches stable across small edits.
+    emotion_objects may be any iterable; each batch is yielded as soon as it
+    is closed, so batching can run while objects are still being generated.
+
+    Yields:
+        (synthesis_text, objects) tuples in document order.
+    """
+    return ssml.iter_documents(emotion_objects, is_expressive, max_chars,
+                               is_boundary=_is_batch_boundary)
+
+
+def audio_cache_key(synthesis_text, voice, accept=AUDIO_FORMAT):
+    return make_key(synthesis_text, voice, accept)
+
+
+def _download(response, path):
+    """Stream a synthesize response into path; returns the bytes written."""
+    size = 0
+    with open(path, "wb") as f:
+        for data in response.iter_content(CHUNK_BYTES):
+            f.write(data)
+            size += len(data)
+    return size
+
+
+def _synthesize_to(tts_service, text, voice, accept, path):
+    def synthesize():
+        return http_client.call_with_retries(lambda: _download(tts_service.synthesize(
+            text,
+            voice=voice,
+            accept=accept,
+            stream=True,
+        ).get_result(), path), service="tts")
+
+    try:
+        return synthesize()
+    except ApiException as e:
+        if e.code != 401:
+            raise
+    # The cached token was revoked or expired early: drop it and try once more
+    print("🔑 TTS rejected the IAM token, retrying with a new one")
+    metrics.count("token_rejections", service="tts")
+    tts_service.authenticator.token_manager.invalidate()
+    return synthesize()
+
+
+def _synthesize_batch(tts_service, synthesis_text, voice, path, audio_format=OUTPUT_FORMAT,
+                      checkpoint=None, use_cache=True):
+    """
+    Synthesize one batch into the file path, falling back to a basic voice
+    on failure. The audio is streamed to disk as it arrives.
+
+    Only audio in the requested voice is added to the audio cache (if
+    use_cache) and the checkpoint, so a resumed conversion retries batches
+    that fell back.
+    """
+    try:
+        started = time.perf_counter()
+        with metrics.span("tts.synthesize", voice=voice, chars=len(synthesis_text),
+                          format=audio_format.name) as span:
+            span.set(bytes=_synthesize_to(tts_service, synthesis_text, voice,
+                                          audio_format.accept, path))
+        record_synthesis(len(synthesis_text), time.perf_counter() - started)
+        key = audio_cache_key(synthesis_text, voice, audio_format.accept)
+        if use_cache:
+            audio_cache.set_file(key, path)
+        if checkpoint is not None:
+            checkpoint.save_segment_file(key, path)
+        return path
+    except Exception as e:
+        print(f"❌ Error with {voice} voice: {e}")
+        print("🔄 Falling back to basic synthesis...")
+
+        # Fallback: use basic voice without emotions
+        fallback_text = ssml.strip_expression(synthesis_text)
+        try:
+            with metrics.span("tts.synthesize_fallback", voice=FALLBACK_VOICE,
+                              chars=len(fallback_text), format=audio_format.name) as span:
+                span.set(bytes=_synthesize_to(tts_service, fallback_text, FALLBACK_VOICE,
+                                              audio_format.accept, path))
+        except Exception as fallback_error:
+            print(f"❌ Fallback also failed: {fallback_error}")
+            raise
+
+        print("✅ Audio generated with fallback voice")
+        return path
+
+
+def synthesize_file(synthesis_text, voice_name, api_key, path, audio_format=OUTPUT_FORMAT):
+    """
+    Synthesize one rendered batch into the file path in exactly the
+    requested voice: unlike synthesize_batches there is no audio cache and
+    no fallback voice, so a failure raises instead of producing another
+    voice. Used for voice previews.
+
+    Returns:
+        Number of bytes written.
+    """
+    voice = resolve_voice(voice_name)
+    with metrics.span("tts.synthesize", voice=voice, chars=len(synthesis_text),
+                      format=audio_format.name) as span:
+        size = _synthesize_to(get_tts_service(api_key), synthesis_text, voice,
+                              audio_format.accept, path)
+        span.set(bytes=size)
+    return size
+
+
+def resolve_voice(voice_name):
+    """Return the service voice id for a friendly voice name."""
+    return ENGLISH_VOICES.get(voice_name, "en-US_AllisonExpressive")
+
+
+def render_batches(emotion_objects, voice_name, max_batch_chars=MAX_BATCH_CHARS):
+    """Render emotion objects into synthesis batches suited to the voice."""
+    is_expressive = "Expressive" in resolve_voice(voice_name)
+    return iter_batches(emotion_objects, is_expressive, max_batch_chars)
+
+
 def generate_tts(
     emotion_objects,
     output_file="output_audio.mp3",
     voice_name="allison_expressive",
     api_key=None,
+    max_workers=MAX_WORKERS,
+    max_batch_chars=MAX_BATCH_CHARS,
+    use_cache=True,
+    on_batch=None,
+    audio_format=OUTPUT_FORMAT,
+    parts_dir=None,
 ):
     """
     Convert text with emotions to speech and save as a single audio file.
 
+    The emotion objects are grouped into batches that fit the service's
+    request size limit. Batches found in the audio cache are reused; the rest
+    are synthesized concurrently, and everything is joined in order.
+
+    emotion_objects may also be a generator such as model.stream_reader_json:
+    each batch is submitted for synthesis as soon as enough objects have
+    arrived, so synthesis overlaps with generation.
+
     Args:
-        emotion_objects: List of dicts containing 'speech_text' and 'emotion' keys.
+        emotion_objects: Iterable of dicts containing 'speech_text' and 'emotion' keys.
         output_file: Path to save the audio file.
         voice_name: Voice name from ENGLISH_VOICES keys (default: allison_expressive).
         api_key: IBM Cloud API Key.
+        max_workers: Maximum number of concurrent synthesize requests.
+        max_batch_chars: Maximum size in bytes of one synthesize request.
+        use_cache: Reuse and store per-batch audio in the audio cache.
+        on_batch: Optional callback(index, path) invoked from the calling
+            thread for each batch, in document order, as soon as that batch
+            and every batch before it are ready. path is a file holding the
+            batch's audio, valid until the callback returns unless
+            parts_dir is given. Lets callers start playback before the
+            whole file is done.
+        audio_format: audio.AudioFormat of the output (default from
+            ECHOVERSE_AUDIO_FORMAT and ECHOVERSE_AUDIO_RATE).
+        parts_dir: Optional directory the batches are written to, as
+            part_NNNN files that are kept after the call. By default they go
+            to a temporary directory that is removed.
 
     Returns:
         Path to the saved audio file.
     """
-    if not api_key:
-        raise ValueError("API Key is required for TTS generation.")
-
-    authenticator = IAMAuthenticator(api_key)
-    tts_service = TextToSpeechV1(authenticator=authenticator)
-    tts_service.set_service_url(URL)
-
-    # Get actual voice ID from friendly name
-    voice = ENGLISH_VOICES.get(voice_name, "en-US_AllisonExpressive")
-    is_expressive = "Expressive" in voice
-    voice_info = get_voice_info(voice_name)
-
-    print(f"Using voice: {voice_name} ({voice})")
-    print(f"Voice info: {voice_info}")
-
-    if is_expressive:
-        # Build SSML with emotions for expressive voices
-        ssml_parts = ['<speak>']
-
-        for obj in emotion_objects:
-            text = obj["speech_text"]
-            emotion = obj.get("emotion", "NEUTRAL").upper()
-
-            # Map emotion to SSML expression
-            ssml_emotion = EMOTION_MAPPING.get(emotion, "neutral")
-
-            # Create enhanced SSML with emotion and prosody
-            if emotion == 'ANGRY':
-                ssml_part = f'<express-as type="{ssml_emotion}"><prosody rate="fast" pitch="+20%">{text}</prosody></express-as>'
-            elif emotion == 'SAD':
-                ssml_part = f'<express-as type="{ssml_emotion}"><prosody rate="slow" pitch="-15%">{text}</prosody></express-as>'
-            elif emotion == 'HAPPY' or emotion == 'JOY':
-                ssml_part = f'<express-as type="{ssml_emotion}"><prosody rate="medium" pitch="+10%">{text}</prosody></express-as>'
-            elif emotion == 'FEAR':
-                ssml_part = f'<express-as type="{ssml_emotion}"><prosody rate="fast" pitch="+25%">{text}</prosody></express-as>'
-            elif emotion == 'SURPRISE':
-                ssml_part = f'<express-as type="{ssml_emotion}"><prosody rate="fast" pitch="+20%">{text}</prosody></express-as>'
-            elif emotion == 'DISGUST':
-                ssml_part = f'<express-as type="{ssml_emotion}"><prosody rate="slow" pitch="-10%">{text}</prosody></express-as>'
-            else:
-                # Neutral and other emotions
-                ssml_part = f'<express-as type="{ssml_emotion}">{text}</express-as>'
+    return synthesize_batches(
+        render_batches(emotion_objects, voice_name, max_batch_chars),
+        output_file, voice_name, api_key,
+        max_workers=max_workers, use_cache=use_cache, on_batch=on_batch,
+        audio_format=audio_format, parts_dir=parts_dir,
+    )
+
+
+def synthesize_batches(
+    batches,
+    output_file,
+    voice_name,
+    api_key,
+    max_workers=MAX_WORKERS,
+    use_cache=True,
+    on_batch=None,
+    checkpoint=None,
+    audio_format=OUTPUT_FORMAT,
+    parts_dir=None,
+):
+    """
+    Synthesize already rendered batches and join them into output_file.
 
-            # Add pause between sentences
-            ssml_part += '<break time="0.8s"/>'
+    Every batch is streamed to its own file and the files are joined into
+    output_file piece by piece, so memory use does not grow with the length
+    of the audiobook.
 
-            ssml_parts.append(ssml_part)
+    Args:
+        batches: Iterable of (synthesis_text, objects) tuples, as produced by
+            render_batches.
+        checkpoint: Optional checkpoints.CheckpointStore. Finished batches are
+            recorded in it and reused when the conversion is resumed, even
+            after they were evicted from the audio cache.
+        Others: Same as generate_tts.
 
-        ssml_parts.append('</speak>')
-        synthesis_text = ''.join(ssml_parts)
+    Returns:
+        Path to the saved audio file.
+    """
+    tts_service = get_tts_service(api_key)
 
-        print(f"Generated SSML: {synthesis_text[:300]}...")  # Debug print
+    # Get actual voice ID from friendly name
+    voice = resolve_voice(voice_name)
+    is_expressive = "Expressive" in voice
 
-    else:
-        # Use simple text concatenation for standard voices
-        synthesis_text = ". ".join([obj["speech_text"]
-                                   for obj in emotion_objects])
+    print(f"Using voice: {voice_name} ({voice}), {audio_format.accept}")
+    if not is_expressive:
         print(f"Using standard voice - no emotion support")
 
-    try:
-        # Generate audio
-        response = tts_service.synthesize(
-            synthesis_text,
-            voice=voice,
-            accept="audio/mp3"
-        ).get_result()
-
-        with open(output_file, "wb") as audio_file:
-            audio_file.write(response.content)
-
-        print(f"✅ Audio successfully generated with {voice_name}")
-
-    except Exception as e:
-        print(f"❌ Error with {voice_name} voice: {e}")
-        print("🔄 Falling back to basic synthesis...")
-
-        try:
-            # Fallback: use basic voice without emotions
-            combined_text = ". ".join([obj["speech_text"]
-                                      for obj in emotion_objects])
-            response = tts_service.synthesize(
-                combined_text,
-                voice="en-US_AllisonV3Voice",
-                accept="audio/mp3"
-            ).get_result()
+    # Part files in document order, with futures for those being synthesized
+    pending = []
+    ready = []
+    submitted = 0
+
+    def collect_ready(wait=False):
+        """Move finished batches from the front of pending into ready."""
+        while len(ready) < len(pending):
+            path, future = pending[len(ready)]
+            if future is not None:
+                if not wait and not future.done():
+                    return
+                future.result()
+            ready.append(path)
+            if on_batch:
+                on_batch(len(ready) - 1, path)
+
+    parts = (contextlib.nullcontext(parts_dir) if parts_dir is not None
+             else tempfile.TemporaryDirectory(prefix="echoverse_tts_"))
+    with parts as workdir, ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        for index, (synthesis_text, _) in enumerate(batches):
+            key = audio_cache_key(synthesis_text, voice, audio_format.accept)
+            path = os.path.join(workdir, f"part_{index:04d}{audio_format.extension}")
+            found = checkpoint is not None and checkpoint.copy_segment(key, path)
+            if not found and use_cache:
+                found = audio_cache.copy_to(key, path)
+            if found:
+                pending.append((path, None))
+            else:
+                pending.append((path, pool.submit(
+                    _synthesize_batch, tts_service, synthesis_text, voice, path,
+                    audio_format, checkpoint, use_cache)))
+                submitted += 1
+            collect_ready()
 
-            with open(output_file, "wb") as audio_file:
-                audio_file.write(response.content)
+        collect_ready(wait=True)
+        print(f"Synthesized {submitted} of {len(pending)} batch(es) "
+              f"with up to {max_workers} workers")
 
-            print("✅ Audio generated with fallback voice")
+        metrics.count("tts_batches", len(pending) - submitted, source="cache")
+        metrics.count("tts_batches", submitted, source="synthesized")
 
-        except Exception as fallback_error:
-            print(f"❌ Fallback also failed: {fallback_error}")
-            raise
+        with metrics.span("audio.write", parts=len(ready), format=audio_format.name) as span:
+            audio_format.join(ready, output_file)
+            span.set(bytes=os.path.getsize(output_file))
 
+    print(f"✅ Audio successfully generated with {voice_name}")
     print(f"🎵 Audio saved as {output_file}")
     return output_file
 
@@ -217,7 +432,7 @@ def list_available_voices():
 
     print("\n" + "="*60)
     print("📝 EMOTION SUPPORT:")
-    print("   Expressive voices support: " + ", ".join(EMOTION_MAPPING.keys()))
+    print("   Expressive voices support: " + ", ".join(ssml.STYLES))
     print("="*60)
 
 
@@ -230,7 +445,7 @@ def test_voice(voice_name, test_text="Hello, this is a test of the text to speec
         return False
 
     test_objects = [{"speech_text": test_text, "emotion": "NEUTRAL"}]
-    test_file = f"test_{voice_name}.mp3"
+    test_file = f"test_{voice_name}{OUTPUT_FORMAT.extension}"
 
     try:
         generate_tts(test_objects, test_file, voice_name)
@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import metrics
+import ssml
+from audio import FORMATS, AudioFormat
+from cache import make_key
+from tts import ENGLISH_VOICES, MAX_WORKERS, OUTPUT_FORMAT, render_batches, resolve_voice, synthesize_file
+
+PREVIEW_ROOT = Path(os.getenv("ECHOVERSE_PREVIEW_DIR", ".echoverse_previews"))
+# Bump when samples should be re-synthesized for reasons the library
+# version cannot see, e.g. a change of how they are rendered
+PREVIEW_VERSION = "1"
+
+# What each emotion's sample says; voices without expressive styles only
+# get the NEUTRAL one
+SAMPLE_TEXTS = {
+    "NEUTRAL": "Welcome to EchoVerse. This is how your audiobook will sound in this voice.",
+    "ANGRY": "I told you three times already, and you still did not listen!",
+    "SAD": "The house was quiet now, and the letters would never come again.",
+    "HAPPY": "What a wonderful morning, everything is finally going our way!",
+    "FEAR": "Something moved in the dark, and the door began to open.",
+    "SURPRISE": "You did all of this for me? I had no idea!",
+    "DISGUST": "The kitchen smelled of something that had been left far too long.",
+    "EXCITED": "We made it to the final round, and the crowd is going wild!",
+    "CALM": "Take a slow breath, and let the waves carry your thoughts away.",
+}
+
+
+def emotions_for(voice_name):
+    """Emotions a voice gets samples for, NEUTRAL first."""
+    if "Expressive" not in resolve_voice(voice_name):
+        return ["NEUTRAL"]
+    return ["NEUTRAL"] + [emotion for emotion in ssml.STYLES if emotion != "NEUTRAL"]
+
+
+class PreviewLibrary:
+    """
+    Pre-synthesized voice samples, one per voice and emotion, so voices can
+    be auditioned without a conversion or a live synthesis call.
+
+    Samples live in a directory named after the library version, a hash of
+    the sample texts, the emotion styles and the audio format; changing any
+    of them starts a new, empty version instead of serving stale audio. A
+    manifest.json in the directory lists the finished samples.
+
+    Args:
+        root: Directory holding one sub-directory per library version.
+        audio_format: audio.AudioFormat of the samples.
+    """
+
+    def __init__(self, root=PREVIEW_ROOT, audio_format=OUTPUT_FORMAT):
+        self.root = Path(root)
+        self.audio_format = audio_format
+        self.version = make_key(
+            PREVIEW_VERSION, audio_format.accept,
+            json.dumps(SAMPLE_TEXTS, sort_keys=True),
+            json.dumps(ssml.STYLES, sort_keys=True))[:16]
+        self.directory = self.root / self.version
+        self._lock = threading.Lock()
+        self._manifest = {}  # voice name -> {"voice", "samples": {emotion: file}}
+        self._loaded_mtime = None
+
+    def _load(self):
+        """(Re)read the manifest when it changed, e.g. by a build elsewhere."""
+        path = self.directory / "manifest.json"
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._loaded_mtime:
+            return
+        try:
+            self._manifest = json.loads(path.read_text(encoding="utf-8"))["voices"]
+            self._loaded_mtime = mtime
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / "manifest.json"
+        tmp_path = path.with_name(f"manifest.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps({
+            "version": self.version,
+            "format": self.audio_format.to_dict(),
+            "updated": time.time(),
+            "voices": self._manifest,
+        }, indent=2), encoding="utf-8")
+        os.replace(tmp_path, path)
+        self._loaded_mtime = path.stat().st_mtime_ns
+
+    def path(self, voice_name, emotion="NEUTRAL"):
+        """
+        Return the sample file of a voice and emotion, or None if the library
+        has none, or only one synthesized for another voice id.
+        """
+        with self._lock:
+            self._load()
+            entry = self._manifest.get(voice_name)
+        if not entry or entry["voice"] != resolve_voice(voice_name):
+            return None
+        name = entry["samples"].get(emotion)
+        if name is None or not (self.directory / name).exists():
+            return None
+        return self.directory / name
+
+    def emotions(self, voice_name):
+        """Emotions with a sample available for the voice."""
+        return [emotion for emotion in emotions_for(voice_name)
+                if self.path(voice_name, emotion) is not None]
+
+    def missing(self, voices=None):
+        """(voice name, emotion) pairs without a sample yet."""
+        return [(voice_name, emotion)
+                for voice_name in (voices or ENGLISH_VOICES)
+                for emotion in emotions_for(voice_name)
+                if self.path(voice_name, emotion) is None]
+
+    def _synthesize(self, voice_name, emotion, api_key):
+        """Synthesize one sample and record it in the manifest."""
+        synthesis_text, _ = next(iter(render_batches(
+            [{"speech_text": SAMPLE_TEXTS[emotion], "emotion": emotion}], voice_name)))
+        name = f"{voice_name}_{emotion.lower()}{self.audio_format.extension}"
+        path = self.directory / name
+        # Written aside and moved into place, so the UI never sees half a file
+        tmp_path = path.with_name(f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            synthesize_file(synthesis_text, voice_name, api_key, tmp_path, self.audio_format)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+        with self._lock:
+            self._load()
+            entry = self._manifest.get(voice_name)
+            if entry is None or entry["voice"] != resolve_voice(voice_name):
+                entry = self._manifest[voice_name] = {"voice": resolve_voice(voice_name),
+                                                      "samples": {}}
+            entry["samples"][emotion] = name
+            self._save()
+        return path
+
+    def build(self, api_key, voices=None, max_workers=MAX_WORKERS, force=False):
+        """
+        Synthesize the missing samples in parallel and remove older library
+        versions once every sample is in place.
+
+        Args:
+            api_key: TTS API key.
+            voices: Voice names to build; all of ENGLISH_VOICES by default.
+            max_workers: Concurrent synthesize requests.
+            force: Re-synthesize samples that already exist.
+
+        Returns:
+            Dict with the number of samples built, reused and failed.
+        """
+        voices = list(voices or ENGLISH_VOICES)
+        wanted = [(voice_name, emotion) for voice_name in voices
+                  for emotion in emotions_for(voice_name)]
+        todo = wanted if force else self.missing(voices)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        print(f"🎤 Building {len(todo)} of {len(wanted)} voice preview(s) "
+              f"in library {self.version} with up to {max_workers} workers")
+
+        def build_one(voice_name, emotion):
+            try:
+                self._synthesize(voice_name, emotion, api_key)
+                metrics.count("voice_previews", status="built")
+                return True
+            except Exception as e:
+                print(f"❌ Preview {voice_name}/{emotion} failed: {e}")
+                metrics.count("voice_previews", status="failed")
+                return False
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            results = list(pool.map(lambda pair: build_one(*pair), todo))
+
+        summary = {"built": sum(results), "reused": len(wanted) - len(todo),
+                   "failed": len(results) - sum(results)}
+        if not summary["failed"] and voices == list(ENGLISH_VOICES):
+            self.prune()
+        print(f"✅ Voice previews: {summary['built']} built, {summary['reused']} reused, "
+              f"{summary['failed']} failed")
+        return summary
+
+    def prune(self):
+        """Remove the directories of every other library version."""
+        if not self.root.is_dir():
+            return
+        for directory in self.root.iterdir():
+            if directory.is_dir() and directory.name != self.version:
+                shutil.rmtree(directory, ignore_errors=True)
+
+
+_library = None
+_library_lock = threading.Lock()
+
+
+def get_preview_library():
+    """Return the process-wide preview library in the default audio format."""
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = PreviewLibrary()
+        return _library
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Pre-synthesize voice samples for auditioning voices in the app.")
+    parser.add_argument("--voices", help="Comma-separated voice names (default: all)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help="Concurrent synthesize requests")
+    parser.add_argument("--format", default=OUTPUT_FORMAT.name, choices=sorted(FORMATS),
+                        help="Audio format of the samples (default: the app's)")
+    parser.add_argument("--sample-rate", type=int, default=OUTPUT_FORMAT.rate,
+                        help="Audio sample rate in Hz")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-synthesize samples that already exist")
+    args = parser.parse_args(argv)
+
+    voices = args.voices.split(",") if args.voices else None
+    unknown = sorted(set(voices or []) - set(ENGLISH_VOICES))
+    if unknown:
+        parser.error(f"Unknown voice(s): {', '.join(unknown)}")
+    try:
+        audio_format = AudioFormat(args.format, args.sample_rate)
+    except ValueError as e:
+        parser.error(str(e))
+    tts_api_key = os.getenv("TTS_API_KEY")
+    if not tts_api_key:
+        parser.error("TTS_API_KEY is not set.")
+
+    summary = PreviewLibrary(audio_format=audio_format).build(
+        tts_api_key, voices, max_workers=args.workers, force=args.force)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())